@@ -0,0 +1,325 @@
+#!/usr/bin/python
+#
+# benchmarks for the map, FOV, rendering, AI and save/load code in potion.py
+#
+
+import os
+
+#rendering blits to a root console, so the benchmarks open one. SDL's dummy video
+#driver gives us one without a display (and without a window popping up)
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import argparse
+import json
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy
+import tcod as libtcod
+
+import potion
+
+
+SIZES = [(80, 19), (80, 43), (256, 256), (1024, 1024)]
+DENSITIES = [1, 5, 20]  #monsters per 100 floor tiles
+
+SEED = 1234
+
+#every benchmark runs at least MIN_RUNS times, and keeps going until it has used
+#up its time budget (or reached MAX_RUNS)
+MIN_RUNS = 5
+MAX_RUNS = 2000
+BUDGET = 0.5  #seconds
+
+#names of the benchmarks to run, or None for all of them
+ONLY = None
+
+#the game's own map size and room count, which bigger maps are scaled from
+BASE_MAX_ROOMS = potion.MAX_ROOMS
+BASE_AREA = potion.MAP_WIDTH * potion.MAP_HEIGHT
+
+
+def reseed(seed):
+    #reseed the default generator, which each new game draws its game seed from
+    libtcod.random_restore(None, libtcod.random_new_from_seed(seed))
+
+def init_root():
+    font = os.path.join(os.path.dirname(os.path.abspath(potion.__file__)), 'font-6.png')
+    libtcod.console_set_custom_font(font, libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_ASCII_INROW)
+    libtcod.console_init_root(potion.SCREEN_WIDTH, potion.SCREEN_HEIGHT, 'potion.py benchmarks', False)
+
+def set_map_size(width, height):
+    #resize the map, keeping the number of rooms proportional to the area
+    potion.MAP_WIDTH = width
+    potion.MAP_HEIGHT = height
+    potion.MAX_ROOMS = max(1, BASE_MAX_ROOMS * width * height // BASE_AREA)
+
+def floor_tiles():
+    (xs, ys) = numpy.nonzero(~potion.map.window('blocked', 0, 0, potion.map.width, potion.map.height))
+    return list(zip(xs.tolist(), ys.tolist()))
+
+def add_monsters(density, rng):
+    #top up the level with orcs until there are "density" monsters per 100 floor tiles
+    floor = floor_tiles()
+    wanted = len(floor) * density // 100
+    monsters = sum(1 for obj in potion.objects if obj.ai)
+    rng.shuffle(floor)
+    for (x, y) in floor:
+        if monsters >= wanted:
+            break
+        if not potion.is_blocked(x, y):
+            monster = potion.TEMPLATES.spawn('orc', x, y)
+            potion.objects.append(monster)
+            potion.occupancy.add(monster)
+            monsters += 1
+    return monsters
+
+def new_level(seed):
+    #a fresh game on a fresh map. the player can't die, so the AI benchmark keeps its monsters busy
+    reseed(seed)
+    potion.new_game()
+    potion.player.fighter.base_max_hp = potion.player.fighter.hp = 10 ** 9
+    potion.recompute_fov()
+
+def step_player(rng):
+    #move the player to a random free neighbouring tile, like one keypress would
+    player = potion.player
+    options = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+               if (dx or dy) and not potion.is_blocked(player.x + dx, player.y + dy)]
+    if options:
+        (dx, dy) = rng.choice(options)
+        player.move(dx, dy)
+    potion.fov_recompute = True
+
+
+def wanted(name):
+    return ONLY is None or name in ONLY
+
+def measure(function, setup=None, inner=1):
+    #time "function" repeatedly. each sample is the average time of "inner" back-to-back calls,
+    #so very cheap operations aren't drowned in timer overhead. returns per-call times in seconds
+    samples = []
+    spent = 0.0
+    while len(samples) < MIN_RUNS or (spent < BUDGET and len(samples) < MAX_RUNS):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for i in range(inner):
+            function()
+        elapsed = time.perf_counter() - start
+        samples.append(elapsed / inner)
+        spent += elapsed
+    return samples
+
+def summarize(name, params, samples):
+    samples = sorted(samples)
+    total = sum(samples)
+    result = {
+        'name': name,
+        'runs': len(samples),
+        'ops_per_sec': len(samples) / total if total > 0 else float('inf'),
+        'p50_us': samples[int(0.50 * (len(samples) - 1))] * 1e6,
+        'p99_us': samples[int(0.99 * (len(samples) - 1))] * 1e6,
+    }
+    result.update(params)
+    return result
+
+
+def monster_bytes(count=10000):
+    #memory taken by one monster (the Object and all of its components), measured with tracemalloc
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    monsters = [potion.TEMPLATES.spawn('orc', x, 0) for x in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / len(monsters)
+
+def bench_generation(width, height):
+    #make_map, initialize_fov and set_terrain don't depend on the monster density
+    params = {'map': '%dx%d' % (width, height), 'density': None, 'monsters': None}
+    results = []
+
+    seeds = iter(range(SEED, SEED + MAX_RUNS + 1))
+    def make_map():
+        potion.game_seed = next(seeds)
+        potion.make_map()
+    new_level(SEED)
+    if wanted('make_map'):
+        results.append(summarize('make_map', params, measure(make_map)))
+    if wanted('initialize_fov'):
+        results.append(summarize('initialize_fov', params, measure(potion.initialize_fov)))
+    if wanted('set_terrain'):
+        #closing a door on the player's tile and opening it again: each is a one-tile set_terrain
+        (x, y) = (potion.player.x, potion.player.y)
+        def toggle_door():
+            potion.set_terrain(x, y, x + 1, y + 1, True, True)
+            potion.set_terrain(x, y, x + 1, y + 1, False, False)
+        results.append(summarize('set_terrain', params, [s / 2 for s in measure(toggle_door)]))
+    if wanted('spawn'):
+        #building one monster from its template
+        results.append(summarize('spawn', params, measure(lambda: potion.TEMPLATES.spawn('orc', 0, 0), inner=100)))
+    return results
+
+def bench_level(width, height, density, workdir):
+    rng = random.Random(SEED)
+    new_level(SEED)
+    monsters = add_monsters(density, rng)
+    params = {'map': '%dx%d' % (width, height), 'density': density, 'monsters': monsters}
+    results = []
+
+    #is_blocked on random tiles all over the map
+    coords = [(rng.randrange(width), rng.randrange(height)) for i in range(1000)]
+    def is_blocked():
+        for (x, y) in coords:
+            potion.is_blocked(x, y)
+    if wanted('is_blocked'):
+        samples = measure(is_blocked)
+        results.append(summarize('is_blocked', params, [s / len(coords) for s in samples]))
+
+    #the player's FOV after a step, and exploring what's in it
+    if wanted('recompute_fov'):
+        results.append(summarize('recompute_fov', params, measure(potion.recompute_fov, lambda: step_player(rng))))
+
+    #one frame after the player took a step, with each renderer
+    for (name, render) in [('render_all', potion.render_all), ('nethack_render', potion.nethack_render)]:
+        if wanted(name):
+            potion.initialize_fov()
+            render()
+            results.append(summarize(name, params, measure(render, lambda: step_player(rng))))
+
+    #the monsters' half of a turn (BasicMonster.take_turn for every monster), from a fresh FOV
+    def before_turn():
+        step_player(rng)
+        potion.recompute_fov()
+    if wanted('monster_turn'):
+        results.append(summarize('monster_turn', params, measure(potion.monsters_take_turn, before_turn)))
+
+    #finding a target for a spell: the closest monster in view, and everything in a fireball's blast
+    if wanted('closest_monster'):
+        results.append(summarize('closest_monster', params, measure(lambda: potion.closest_monster(potion.TORCH_RADIUS),
+                                                                    before_turn, inner=10)))
+    if wanted('within'):
+        results.append(summarize('within', params, measure(lambda: potion.occupancy.within(potion.player.x, potion.player.y,
+                                                                                           potion.FIREBALL_RADIUS),
+                                                           before_turn, inner=10)))
+
+    #saving and loading the whole game. autosave is only the part the main loop waits for
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        if wanted('save_game') or wanted('load_game'):
+            save = measure(potion.save_game)
+            if wanted('save_game'):
+                results.append(summarize('save_game', params, save))
+        if wanted('autosave'):
+            results.append(summarize('autosave', params, measure(potion.autosave, potion.save_writer.wait)))
+            potion.save_writer.wait()
+        if wanted('load_game'):
+            results.append(summarize('load_game', params, measure(potion.load_game)))
+    finally:
+        os.chdir(cwd)
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_result(result, baseline=None):
+    line = '%-15s %-10s %7s %7s %12.1f %12.2f %12.2f' % (
+        result['name'], result['map'], '-' if result['density'] is None else result['density'],
+        '-' if result['monsters'] is None else result['monsters'],
+        result['ops_per_sec'], result['p50_us'], result['p99_us'])
+    if baseline is not None:
+        old = baseline.get((result['name'], result['map'], result['density']))
+        if old is not None:
+            line += '   %6.2fx' % (result['ops_per_sec'] / old['ops_per_sec'])
+    print(line)
+    sys.stdout.flush()
+
+def main():
+    global MIN_RUNS, BUDGET, ONLY
+
+    parser = argparse.ArgumentParser(description='Benchmark the core routines of potion.py.')
+    parser.add_argument('--sizes', nargs='+', default=['%dx%d' % size for size in SIZES],
+                        help='map sizes to run, as WIDTHxHEIGHT')
+    parser.add_argument('--densities', nargs='+', type=int, default=DENSITIES,
+                        help='monster densities to run, in monsters per 100 floor tiles')
+    parser.add_argument('--only', nargs='+', default=None, help='only run the named benchmarks')
+    parser.add_argument('--budget', type=float, default=BUDGET, help='seconds to spend on each benchmark')
+    parser.add_argument('--min-runs', type=int, default=MIN_RUNS, help='fewest samples per benchmark')
+    parser.add_argument('--json', default=None, help='write the results to this file, for comparing commits')
+    parser.add_argument('--compare', default=None, help='a --json file from an earlier run to compare against')
+    args = parser.parse_args()
+
+    BUDGET = args.budget
+    MIN_RUNS = args.min_runs
+    ONLY = args.only
+
+    baseline = None
+    baseline_memory = None
+    if args.compare:
+        with open(args.compare) as file:
+            report = json.load(file)
+        baseline = dict(((r['name'], r['map'], r['density']), r) for r in report['results'])
+        baseline_memory = report.get('monster_bytes')
+
+    init_root()
+    potion.policy = None
+    potion.autosave_file = potion.SAVE_FILE
+    potion.pregenerate = False  #a worker thread generating levels would skew the timings
+    potion.key = libtcod.Key()
+    potion.mouse = libtcod.Mouse()
+
+    memory = None
+    if wanted('monster_bytes'):
+        memory = monster_bytes()
+        print('%.0f bytes per monster' % memory)
+        if baseline_memory:
+            print('  (%.2fx the baseline)' % (memory / baseline_memory))
+
+    print('%-15s %-10s %7s %7s %12s %12s %12s' % ('benchmark', 'map', 'density', 'mobs', 'ops/sec', 'p50 us', 'p99 us'))
+    results = []
+    workdir = tempfile.mkdtemp(prefix='potion-bench-')
+    try:
+        for size in args.sizes:
+            (width, height) = [int(n) for n in size.split('x')]
+            set_map_size(width, height)
+
+            level_results = bench_generation(width, height)
+            for density in args.densities:
+                level_results += bench_level(width, height, density, workdir)
+
+            for result in level_results:
+                print_result(result, baseline)
+                results.append(result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        report = {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'tcod': getattr(libtcod, '__version__', None),
+            'seed': SEED,
+            'monster_bytes': memory,
+            'results': results,
+        }
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
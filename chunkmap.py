@@ -0,0 +1,193 @@
+#
+# chunked tile map: the map in square chunks, so a huge map only costs memory around the player
+# and where it's been explored. a chunk's tiles are only made the first time they're needed, from
+# the rectangles dug into it, and chunks the player left behind are packed away
+#
+
+import numpy
+
+
+CHUNK_SIZE = 32
+
+#the layers of a chunk's array, which is indexed [layer, x, y]
+BLOCKED = 0
+BLOCK_SIGHT = 1
+EXPLORED = 2
+LAYERS = {'blocked': BLOCKED, 'block_sight': BLOCK_SIGHT, 'explored': EXPLORED}
+
+
+def drop_covered(fills, x1, y1, x2, y2):
+    #remove the rectangles entirely inside [x1, x2) x [y1, y2) from a chunk's fills, in place
+    i = 0
+    while i < len(fills):
+        if x1 <= fills[i] and y1 <= fills[i + 1] and fills[i + 2] <= x2 and fills[i + 3] <= y2:
+            del fills[i:i + 5]
+        else:
+            i += 5
+
+
+class ChunkedTileMap:
+    #the same layers as TileMap, stored chunk by chunk. a chunk is either resident (unpacked into an
+    #array), or only kept as the list of rectangles filled in it, in order (leaving out the ones a
+    #later rectangle covers entirely), plus its explored tiles packed into bits if it has any.
+    #that's all it takes to make its array again
+    def __init__(self, width, height, chunk_size=CHUNK_SIZE):
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.resident = {}  #(cx, cy) -> array of the chunk's layers
+        self.fills = {}  #(cx, cy) -> the rectangles filled in a chunk (see fill)
+        self.packed = {}  #(cx, cy) -> the explored tiles of a chunk that isn't resident, as bits
+
+    def chunk_shape(self, cx, cy):
+        #the size of a chunk (the ones on the right and bottom edges may be cut short)
+        size = self.chunk_size
+        return (min(size, self.width - cx * size), min(size, self.height - cy * size))
+
+    def chunks_in(self, x1, y1, x2, y2):
+        #the chunks that overlap the rectangle [x1, x2) x [y1, y2), as a rectangle of chunks
+        #(cx1, cy1, cx2, cy2), also with the end excluded
+        size = self.chunk_size
+        return (max(0, x1) // size, max(0, y1) // size,
+                (min(x2, self.width) - 1) // size + 1, (min(y2, self.height) - 1) // size + 1)
+
+    def fill(self, x1, y1, x2, y2, blocked, block_sight, merge=True):
+        #set the terrain of every tile in the rectangle [x1, x2) x [y1, y2). with "merge", the
+        #rectangles filled before that it covers entirely are dropped, since they don't matter any
+        #more: filling the same place over and over (like a door opened and closed) doesn't grow
+        (x1, y1, x2, y2) = (max(0, x1), max(0, y1), min(x2, self.width), min(y2, self.height))
+        if x1 >= x2 or y1 >= y2:
+            return
+        size = self.chunk_size
+        (cx1, cy1, cx2, cy2) = self.chunks_in(x1, y1, x2, y2)
+        for cx in range(cx1, cx2):
+            for cy in range(cy1, cy2):
+                (left, top) = (cx * size, cy * size)
+                (a1, b1, a2, b2) = (max(x1, left) - left, max(y1, top) - top,
+                                    min(x2, left + size) - left, min(y2, top + size) - top)
+
+                #each rectangle takes 5 bytes: its corners in chunk coordinates, then the terrain
+                fills = self.fills.get((cx, cy))
+                if fills is None:
+                    fills = self.fills[(cx, cy)] = bytearray()
+                elif merge:
+                    drop_covered(fills, a1, b1, a2, b2)
+                fills += bytes((a1, b1, a2, b2, blocked | block_sight << 1))
+
+                array = self.resident.get((cx, cy))
+                if array is not None:
+                    array[BLOCKED, a1:a2, b1:b2] = blocked
+                    array[BLOCK_SIGHT, a1:a2, b1:b2] = block_sight
+
+    def dig(self, x1, y1, x2, y2):
+        #make every tile in the rectangle [x1, x2) x [y1, y2) passable and see-through. this is
+        #for generating the map, which only digs so many rectangles, so it doesn't spend the time
+        #looking for the ones it covers
+        self.fill(x1, y1, x2, y2, False, False, merge=False)
+
+    def chunk(self, cx, cy):
+        #the array of a chunk, making it resident if it isn't
+        array = self.resident.get((cx, cy))
+        if array is None:
+            #fill map with "blocked" tiles, which also block sight; then everything dug into it
+            (width, height) = self.chunk_shape(cx, cy)
+            array = numpy.ones((len(LAYERS), width, height), dtype=bool)
+            for (x1, y1, x2, y2, terrain) in self.rectangles(cx, cy):
+                array[BLOCKED, x1:x2, y1:y2] = terrain & 1
+                array[BLOCK_SIGHT, x1:x2, y1:y2] = terrain >> 1
+
+            packed = self.packed.pop((cx, cy), None)
+            if packed is None:
+                array[EXPLORED] = False
+            else:
+                array[EXPLORED] = numpy.unpackbits(numpy.frombuffer(packed, dtype=numpy.uint8),
+                                                   count=width * height).reshape((width, height))
+            self.resident[(cx, cy)] = array
+        return array
+
+    def keep_resident(self, cx1, cy1, cx2, cy2):
+        #pack away every resident chunk outside the rectangle of chunks [cx1, cx2) x [cy1, cy2).
+        #only their explored tiles are kept (if any), everything else can be made again
+        for (cx, cy) in list(self.resident):
+            if not (cx1 <= cx < cx2 and cy1 <= cy < cy2):
+                explored = self.resident.pop((cx, cy))[EXPLORED]
+                if explored.any():
+                    self.packed[(cx, cy)] = numpy.packbits(explored).tobytes()
+
+    def get(self, layer, x, y):
+        #one tile of a layer, by name. the tile's chunk is made resident if it isn't (it's packed
+        #away again with the others by keep_resident), except to look up whether it's explored,
+        #which its packed explored tiles tell
+        size = self.chunk_size
+        (cx, cy) = (x // size, y // size)
+        array = self.resident.get((cx, cy))
+        if array is not None:
+            return array.item(LAYERS[layer], x % size, y % size)
+
+        layer = LAYERS[layer]
+        if layer == EXPLORED:
+            packed = self.packed.get((cx, cy))
+            if packed is None:
+                return False
+            bit = (x % size) * self.chunk_shape(cx, cy)[1] + y % size
+            return bool(packed[bit >> 3] & (0x80 >> (bit & 7)))
+        return self.chunk(cx, cy).item(layer, x % size, y % size)
+
+    def rectangles(self, cx, cy):
+        #the rectangles filled in a chunk, in order, as (x1, y1, x2, y2, terrain) in chunk
+        #coordinates. bit 0 of the terrain is "blocked", bit 1 is "block sight"
+        fills = self.fills.get((cx, cy), b'')
+        return [tuple(fills[i:i + 5]) for i in range(0, len(fills), 5)]
+
+    def window(self, layer, x1, y1, x2, y2):
+        #a copy of a layer, by name, over the rectangle [x1, x2) x [y1, y2) (which must be on the
+        #map), indexed [x - x1, y - y1]. the chunks it covers are made resident
+        layer = LAYERS[layer]
+        size = self.chunk_size
+        out = numpy.empty((x2 - x1, y2 - y1), dtype=bool)
+        (cx1, cy1, cx2, cy2) = self.chunks_in(x1, y1, x2, y2)
+        for cx in range(cx1, cx2):
+            for cy in range(cy1, cy2):
+                array = self.chunk(cx, cy)
+                (left, top) = (cx * size, cy * size)
+                (a1, b1) = (max(x1, left), max(y1, top))
+                (a2, b2) = (min(x2, left + array.shape[1]), min(y2, top + array.shape[2]))
+                out[a1 - x1:a2 - x1, b1 - y1:b2 - y1] = array[layer, a1 - left:a2 - left, b1 - top:b2 - top]
+        return out
+
+    def explore(self, x1, y1, visible):
+        #mark the tiles that are True in "visible" as explored. it's indexed [x - x1, y - y1], like
+        #a window. only the chunks with something visible in them are made resident
+        (x2, y2) = (x1 + visible.shape[0], y1 + visible.shape[1])
+        size = self.chunk_size
+        (cx1, cy1, cx2, cy2) = self.chunks_in(x1, y1, x2, y2)
+        for cx in range(cx1, cx2):
+            for cy in range(cy1, cy2):
+                (left, top) = (cx * size, cy * size)
+                (a1, b1) = (max(x1, left), max(y1, top))
+                (a2, b2) = (min(x2, left + size), min(y2, top + size))
+                part = visible[a1 - x1:a2 - x1, b1 - y1:b2 - y1]
+                if part.any():
+                    self.chunk(cx, cy)[EXPLORED, a1 - left:a2 - left, b1 - top:b2 - top] |= part
+
+    def explored_chunks(self):
+        #(cx, cy, explored tiles) for every chunk with any explored tiles, for saving
+        found = []
+        for ((cx, cy), array) in self.resident.items():
+            if array[EXPLORED].any():
+                found.append((cx, cy, array[EXPLORED].copy()))
+        for ((cx, cy), packed) in self.packed.items():
+            (width, height) = self.chunk_shape(cx, cy)
+            explored = numpy.unpackbits(numpy.frombuffer(packed, dtype=numpy.uint8), count=width * height)
+            found.append((cx, cy, explored.reshape((width, height)).astype(bool)))
+        return sorted(found, key=lambda chunk: chunk[:2])
+
+    def set_explored(self, cx, cy, explored):
+        #replace the explored tiles of a chunk, such as when loading
+        array = self.resident.get((cx, cy))
+        if array is not None:
+            array[EXPLORED] = explored
+        elif explored.any():
+            self.packed[(cx, cy)] = numpy.packbits(explored).tobytes()
+        else:
+            self.packed.pop((cx, cy), None)
@@ -0,0 +1,52 @@
+#
+# entity snapshots: the positions and combat stats of many objects at once, copied into numpy
+# arrays indexed by entity id for one turn, so a system can work on all of them in a few
+# vectorized passes. the objects stay the source of truth
+#
+
+import numpy
+
+
+class EntitySnapshot:
+    #entity i is objects[i]. the arrays are a copy of the objects when the snapshot was taken, and
+    #aren't kept up to date: a system takes one per turn, works on the arrays, then writes what
+    #changed back to the objects
+    def __init__(self, objects):
+        count = len(objects)
+        self.objects = objects
+        self.x = numpy.fromiter((obj.x for obj in objects), dtype=numpy.intp, count=count)
+        self.y = numpy.fromiter((obj.y for obj in objects), dtype=numpy.intp, count=count)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def power(self, ids):
+        #the attack power of some of the entities (which must all be fighters), as an array
+        return numpy.fromiter((self.objects[i].fighter.power for i in ids), dtype=numpy.intp, count=len(ids))
+
+
+def resolve_moves(x, y, target_x, target_y, taken):
+    #which entities get to step from (x, y) to (target_x, target_y). "taken" marks the tiles that
+    #can't be entered, the entities' own tiles included, and is kept up to date as they move.
+    #this goes in rounds: in each one, every target tile that is free goes to the lowest id that
+    #wants it, and the tiles those entities leave are free from the next round on, for any entity
+    #still waiting (whatever its id). that's not the same as moving them one by one in id order,
+    #but no two entities ever end up on the same tile, and none enters a tile that was taken when
+    #it stepped. returns a boolean array of the entities that moved
+    height = taken.shape[1]
+    moved = numpy.zeros(len(x), dtype=bool)
+
+    pending = numpy.nonzero((target_x != x) | (target_y != y))[0]
+    while len(pending):
+        free = pending[~taken[target_x[pending], target_y[pending]]]
+        if not len(free):
+            break  #everyone left is waiting for a tile that won't be freed
+
+        #several entities may want the same tile: the first of them gets it
+        (tiles, first) = numpy.unique(target_x[free] * height + target_y[free], return_index=True)
+        winners = free[first]
+        taken[x[winners], y[winners]] = False
+        taken[target_x[winners], target_y[winners]] = True
+        moved[winners] = True
+        pending = pending[~moved[pending]]
+    return moved
@@ -0,0 +1,59 @@
+#
+# flow fields: one flood fill towards a target, shared by everyone walking there
+#
+
+import numpy
+import tcod.path
+
+
+UNREACHABLE = numpy.iinfo(numpy.int32).max
+
+#neighbouring steps, straight ones first so they win ties against diagonals
+NEIGHBOURS = [(0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (1, -1), (-1, 1), (1, 1)]
+
+
+class FlowField:
+    #walking distances to a target tile, for every tile within "radius" of it that isn't blocked
+    #(diagonal steps cost the same as straight ones, like everywhere else in the game).
+    #"blocked" may be just part of the map, with its top left corner at "origin"
+    def __init__(self, blocked, x, y, radius, origin=(0, 0)):
+        (width, height) = blocked.shape
+        (left, top) = origin
+        self.x = x
+        self.y = y
+
+        #only flood the window around the target, so the cost doesn't depend on the map size
+        self.x1 = max(left, x - radius)
+        self.y1 = max(top, y - radius)
+        self.x2 = min(left + width, x + radius + 1)
+        self.y2 = min(top + height, y + radius + 1)
+
+        cost = (~blocked[self.x1 - left:self.x2 - left, self.y1 - top:self.y2 - top]).astype(numpy.int32)
+        self.distances = numpy.full(cost.shape, UNREACHABLE, dtype=numpy.int32)
+        self.distances[x - self.x1, y - self.y1] = 0
+        tcod.path.dijkstra2d(self.distances, cost, 1, 1, out=self.distances)
+
+    def distance(self, x, y):
+        #walking distance from (x, y) to the target, or UNREACHABLE
+        if self.x1 <= x < self.x2 and self.y1 <= y < self.y2:
+            return self.distances[x - self.x1, y - self.y1]
+        return UNREACHABLE
+
+    def distances_at(self, xs, ys):
+        #like distance(), for arrays of coordinates
+        inside = (xs >= self.x1) & (xs < self.x2) & (ys >= self.y1) & (ys < self.y2)
+        distances = numpy.full(len(xs), UNREACHABLE, dtype=numpy.int32)
+        distances[inside] = self.distances[xs[inside] - self.x1, ys[inside] - self.y1]
+        return distances
+
+    def next_step(self, x, y, is_blocked):
+        #the (dx, dy) step from (x, y) that gets closest to the target without walking into
+        #a blocked tile, or None if no step gets any closer
+        best = self.distance(x, y)
+        step = None
+        for (dx, dy) in NEIGHBOURS:
+            distance = self.distance(x + dx, y + dy)
+            if distance < best and not is_blocked(x + dx, y + dy):
+                best = distance
+                step = (dx, dy)
+        return step
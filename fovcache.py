@@ -0,0 +1,42 @@
+#
+# FOV cache: the tiles lit from the positions the player stood on lately, so standing on one of
+# them again doesn't have to compute the FOV again
+#
+
+import collections
+
+
+class FovCache:
+    #lit tiles by (level, x, y, radius, algorithm, light walls). each entry is the box that was
+    #computed, as (x1, y1, x2, y2), and the lit tiles in it. only the "capacity" most recently used
+    #entries are kept
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()  #least recently used first
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        #the (box, lit tiles) computed for a key, or None
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, box, lit):
+        #remember the lit tiles computed for a key, forgetting the least recently used entry if it's full
+        self.entries[key] = (box, lit)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, level, x1, y1, x2, y2):
+        #forget everything computed on a level that could see the rectangle [x1, x2) x [y1, y2),
+        #after the terrain there changed
+        for (key, ((a1, b1, a2, b2), lit)) in list(self.entries.items()):
+            if key[0] == level and a1 < x2 and x1 < a2 and b1 < y2 and y1 < b2:
+                del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
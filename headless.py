@@ -0,0 +1,205 @@
+#!/usr/bin/python
+#
+# run potion.py without a window: a policy plays instead of the keyboard and mouse
+#
+
+import argparse
+import random
+import time
+
+import tcod as libtcod
+
+import potion
+
+
+#movement keys for each direction, as handle_keys expects them
+MOVE_KEYS = {
+    (0, -1): libtcod.KEY_KP8, (0, 1): libtcod.KEY_KP2,
+    (-1, 0): libtcod.KEY_KP4, (1, 0): libtcod.KEY_KP6,
+    (-1, -1): libtcod.KEY_KP7, (1, -1): libtcod.KEY_KP9,
+    (-1, 1): libtcod.KEY_KP1, (1, 1): libtcod.KEY_KP3,
+    (0, 0): libtcod.KEY_KP5,
+}
+
+
+def move_key(dx, dy):
+    return libtcod.Key(MOVE_KEYS[(dx, dy)])
+
+def char_key(char):
+    return libtcod.Key(libtcod.KEY_CHAR, ord(char))
+
+
+class RandomPolicy:
+    #presses random keys: mostly movement, sometimes picking up, using items or taking the stairs
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+
+    def next_key(self):
+        dice = self.random.randint(0, 99)
+        if dice < 5:
+            return char_key('g')
+        elif dice < 8:
+            return char_key('i')
+        elif dice < 10:
+            return char_key('<')
+        return move_key(self.random.randint(-1, 1), self.random.randint(-1, 1))
+
+    def choose(self, header, options):
+        #any menu: pick something at random (or nothing)
+        return self.random.randint(-1, len(options) - 1) if options else None
+
+    def pick_tile(self, max_range):
+        #any visible tile, otherwise cancel
+        monster = potion.closest_monster(max_range or potion.TORCH_RADIUS)
+        if monster is None:
+            return (None, None)
+        return (monster.x, monster.y)
+
+
+class SeekerPolicy:
+    #a simple bot: fights anything it sees, heals when hurt, grabs items and heads for the stairs
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+        self.chosen_item = None
+        self.path = None
+        self.path_map = None
+
+    def next_key(self):
+        player = potion.player
+
+        #drink a potion when badly hurt, or read a scroll at a monster in view
+        monster = potion.closest_monster(potion.TORCH_RADIUS)
+        if player.fighter.hp < player.fighter.max_hp * 0.4:
+            if self.use_item('healing potion'):
+                return char_key('i')
+        if monster is not None and self.random.randint(0, 9) == 0:
+            if self.use_item('scroll of lightning bolt', 'scroll of fireball', 'scroll of confusion'):
+                return char_key('i')
+
+        #attack the closest monster if it's next to us, otherwise go after it
+        if monster is not None:
+            if abs(monster.x - player.x) <= 1 and abs(monster.y - player.y) <= 1:
+                return move_key(monster.x - player.x, monster.y - player.y)
+            return self.step_towards(monster.x, monster.y)
+
+        #pick up anything lying here
+        if len(potion.inventory) < 26:
+            for obj in potion.occupancy.at(player.x, player.y):
+                if obj.item:
+                    return char_key('g')
+
+        #otherwise go down the stairs
+        stairs = potion.stairs
+        if (player.x, player.y) == (stairs.x, stairs.y):
+            return char_key('<')
+        return self.step_towards(stairs.x, stairs.y)
+
+    def use_item(self, *names):
+        #remember which inventory entry to pick when the inventory menu shows up
+        for (index, obj) in enumerate(potion.inventory):
+            if obj.name in names:
+                self.chosen_item = index
+                return True
+        return False
+
+    def step_towards(self, x, y):
+        #follow a path over the FOV map (a new one whenever it's made again). it only covers the
+        #chunks around the player, so anything further away is out of reach for now
+        if self.path_map is not potion.fov_map:
+            self.path_map = potion.fov_map
+            self.path = libtcod.path_new_using_map(potion.fov_map, 1.41)
+
+        player = potion.player
+        (left, top) = (potion.fov_x, potion.fov_y)
+        if (0 <= x - left < potion.fov_width and 0 <= y - top < potion.fov_height and
+                libtcod.path_compute(self.path, player.x - left, player.y - top, x - left, y - top) and
+                not libtcod.path_is_empty(self.path)):
+            (next_x, next_y) = libtcod.path_get(self.path, 0)
+            return move_key(next_x + left - player.x, next_y + top - player.y)
+
+        #no path (something's in the way): shuffle around
+        return move_key(self.random.randint(-1, 1), self.random.randint(-1, 1))
+
+    def choose(self, header, options):
+        if header.startswith('Level up!'):
+            return self.random.randint(0, len(options) - 1)
+        (index, self.chosen_item) = (self.chosen_item, None)
+        return index
+
+    def pick_tile(self, max_range):
+        #target the closest monster in view
+        monster = potion.closest_monster(max_range or potion.TORCH_RADIUS)
+        if monster is None:
+            return (None, None)
+        return (monster.x, monster.y)
+
+
+POLICIES = {'random': RandomPolicy, 'seeker': SeekerPolicy}
+
+
+def run(policy, turns, seed=None, autosave_file=None):
+    #play up to the given number of turns with no window and no FPS cap, starting a new
+    #game whenever the player dies. autosaves go to autosave_file, if given.
+    #returns a dictionary of statistics about the run
+    if seed is not None:
+        #reseed the default generator, which each new game draws its game seed from
+        libtcod.random_restore(None, libtcod.random_new_from_seed(seed))
+
+    potion.policy = policy
+    potion.autosave_file = autosave_file
+    potion.key = libtcod.Key()
+    potion.mouse = libtcod.Mouse()
+    potion.new_game()
+
+    stats = {'turns': 0, 'actions': 0, 'deaths': 0, 'max_dungeon_level': 1}
+    start = time.time()
+
+    #every action counts, even those that don't take a turn, so a stuck policy can't loop forever
+    while stats['turns'] < turns and stats['actions'] < turns * 10:
+        if potion.game_state == 'dead':
+            stats['deaths'] += 1
+            potion.new_game()
+
+        #the FOV is recomputed where play_game would render the screen
+        if potion.fov_recompute:
+            potion.recompute_fov()
+
+        potion.check_level_up()
+
+        potion.key = policy.next_key()
+        player_action = potion.handle_keys()
+        stats['actions'] += 1
+        if player_action == 'exit':
+            break
+
+        if potion.game_state == 'playing' and player_action != 'didnt-take-turn':
+            potion.monsters_take_turn()
+            stats['turns'] += 1
+            if stats['turns'] % potion.AUTOSAVE_TURNS == 0:
+                potion.autosave()
+
+        stats['max_dungeon_level'] = max(stats['max_dungeon_level'], potion.dungeon_level)
+
+    potion.save_writer.wait()
+    potion.report_save_failures()
+
+    #a level generated ahead of time must wait with all of its chunks packed away
+    for future in potion.pregenerated.values():
+        if future.result().map.resident:
+            raise RuntimeError('the level generated ahead of time has resident chunks')
+    stats['seconds'] = time.time() - start
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play potion.py without a window, to soak-test or profile the turn logic.')
+    parser.add_argument('--turns', type=int, default=10000, help='number of player turns to play')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the game and the policy')
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='seeker', help='who plays')
+    parser.add_argument('--autosave', default=None, help='autosave to this file while playing')
+    args = parser.parse_args()
+
+    stats = run(POLICIES[args.policy](args.seed), args.turns, args.seed, args.autosave)
+    print('%d turns (%d actions) in %.2fs: %.0f turns/sec' % (stats['turns'], stats['actions'], stats['seconds'],
+                                                             stats['turns'] / max(stats['seconds'], 1e-9)))
+    print('deaths: %d, deepest dungeon level: %d' % (stats['deaths'], stats['max_dungeon_level']))
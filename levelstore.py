@@ -0,0 +1,78 @@
+#
+# level store: the dungeon levels the player isn't on, kept as compact encoded blobs
+#
+
+import atexit
+import collections
+import os
+import shutil
+import tempfile
+
+
+class LevelStore:
+    #encoded levels by dungeon level. the "capacity" most recently used ones stay in memory,
+    #older ones are evicted to files in a temporary directory until they're needed again
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.cache = collections.OrderedDict()  #least recently used first
+        self.on_disk = set()
+        self.directory = None
+
+    def __contains__(self, level):
+        return level in self.cache or level in self.on_disk
+
+    def __len__(self):
+        return len(self.cache) + len(self.on_disk)
+
+    def levels(self):
+        #the dungeon levels in the store, in order
+        return sorted(set(self.cache) | self.on_disk)
+
+    def put(self, level, data):
+        #store a level's encoded data, replacing any older copy
+        self.discard(level)
+        self.cache[level] = data
+        while len(self.cache) > self.capacity:
+            (old_level, old_data) = self.cache.popitem(last=False)
+            with open(self.path(old_level), 'wb') as file:
+                file.write(old_data)
+            self.on_disk.add(old_level)
+
+    def get(self, level):
+        #a level's encoded data (reading it back from disk if it was evicted), or None
+        if level in self.cache:
+            self.cache.move_to_end(level)
+            return self.cache[level]
+        if level in self.on_disk:
+            with open(self.path(level), 'rb') as file:
+                data = file.read()
+            self.put(level, data)
+            return data
+        return None
+
+    def peek(self, level):
+        #like get(), but without making the level the most recently used one
+        if level in self.cache:
+            return self.cache[level]
+        if level in self.on_disk:
+            with open(self.path(level), 'rb') as file:
+                return file.read()
+        return None
+
+    def discard(self, level):
+        #forget a level, if it's stored
+        self.cache.pop(level, None)
+        if level in self.on_disk:
+            self.on_disk.remove(level)
+            os.remove(self.path(level))
+
+    def clear(self):
+        for level in list(self.on_disk):
+            self.discard(level)
+        self.cache.clear()
+
+    def path(self, level):
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='potion-levels-')
+            atexit.register(shutil.rmtree, self.directory, True)
+        return os.path.join(self.directory, 'level-%d' % level)
@@ -0,0 +1,72 @@
+#
+# occupancy index: which objects stand on which tile
+#
+
+
+class OccupancyIndex:
+    #objects bucketed by the tile they stand on, in the order they arrived there
+    #(send_to_back puts an object at the bottom of its tile, like in the objects list)
+    def __init__(self, objects=()):
+        self.tiles = {}
+        for obj in objects:
+            self.add(obj)
+
+    def add(self, obj):
+        #start tracking an object at its current position
+        self.tiles.setdefault((obj.x, obj.y), []).append(obj)
+
+    def remove(self, obj):
+        #stop tracking an object (it must still be at the position it was indexed at)
+        self._take(obj, obj.x, obj.y)
+
+    def move(self, obj, old_x, old_y):
+        #the object moved from (old_x, old_y) to its current position
+        self._take(obj, old_x, old_y)
+        self.add(obj)
+
+    def send_to_back(self, obj):
+        #move the object to the bottom of its tile, to match Object.send_to_back
+        bucket = self.tiles[(obj.x, obj.y)]
+        bucket.remove(obj)
+        bucket.insert(0, obj)
+
+    def at(self, x, y):
+        #all objects on a tile
+        return self.tiles.get((x, y), ())
+
+    def in_rect(self, x1, y1, x2, y2):
+        #all objects in the rectangle [x1, x2) x [y1, y2). it looks up each tile of the rectangle,
+        #or goes through the occupied tiles instead if there are fewer of those
+        if (x2 - x1) * (y2 - y1) <= len(self.tiles):
+            found = []
+            for x in range(x1, x2):
+                for y in range(y1, y2):
+                    found.extend(self.tiles.get((x, y), ()))
+            return found
+        return [obj for ((x, y), bucket) in self.tiles.items() if x1 <= x < x2 and y1 <= y < y2 for obj in bucket]
+
+    def within(self, x, y, radius):
+        #all objects at most "radius" away from (x, y)
+        r = int(radius)
+        return [obj for obj in self.in_rect(x - r, y - r, x + r + 1, y + r + 1)
+                if (obj.x - x) ** 2 + (obj.y - y) ** 2 <= radius ** 2]
+
+    def nearest(self, x, y, radius, k=1, where=None):
+        #up to k objects at most "radius" away from (x, y), nearest first. if "where" is given,
+        #only the objects for which where(obj) is true count
+        found = [obj for obj in self.within(x, y, radius) if where is None or where(obj)]
+        found.sort(key=lambda obj: (obj.x - x) ** 2 + (obj.y - y) ** 2)
+        return found[:k]
+
+    def is_blocked(self, x, y):
+        #true if a blocking object stands on the tile
+        for obj in self.tiles.get((x, y), ()):
+            if obj.blocks:
+                return True
+        return False
+
+    def _take(self, obj, x, y):
+        bucket = self.tiles[(x, y)]
+        bucket.remove(obj)
+        if not bucket:
+            del self.tiles[(x, y)]
@@ -4,9 +4,22 @@
 #
 
 import tcod as libtcod
+import tcod.map
 import math
 import textwrap
-import shelve
+import numpy
+import concurrent.futures
+
+from chunkmap import ChunkedTileMap
+from occupancy import OccupancyIndex
+from flowfield import FlowField, NEIGHBOURS
+from entities import EntitySnapshot, resolve_moves
+from levelstore import LevelStore
+from fovcache import FovCache
+from streams import RandomStream, stream_seed
+from spawntables import SpawnTables
+from templates import TemplateRegistry
+import savefile
 
 
 #actual size of the window
@@ -17,6 +30,10 @@ SCREEN_HEIGHT = 24
 MAP_WIDTH = 80
 MAP_HEIGHT = 19
 
+#size of the part of the map that is on screen. on a bigger map, this camera follows the player
+CAMERA_WIDTH = 80
+CAMERA_HEIGHT = 19
+
 #sizes and coordinates relevant for the GUI
 BAR_WIDTH = 20
 PANEL_HEIGHT = 7
@@ -42,6 +59,24 @@ CONFUSE_NUM_TURNS = 10
 FIREBALL_RADIUS = 3
 FIREBALL_DAMAGE = 25
 
+#what shows up in the rooms: how many monsters and items at most, and the chance of each one.
+#every value is a table of [value, from this dungeon level on] steps, 0 before the first step
+SPAWN_TABLES = SpawnTables(
+    max_monsters=[[2, 1], [3, 4], [5, 6]],
+    monster_chances={
+        'orc':       [[80, 1]],  #orc always shows up, even if all other monsters have 0 chance
+        'troll':     [[15, 3], [30, 5], [60, 7]],
+    },
+    max_items=[[1, 1], [2, 4]],
+    item_chances={
+        'heal':      [[35, 1]],  #healing potion always shows up, even if all other items have 0 chance
+        'lightning': [[25, 4]],
+        'fireball':  [[25, 6]],
+        'confuse':   [[10, 2]],
+        'sword':     [[5, 4]],
+        'shield':    [[15, 8]],
+    })
+
 #experience and level-ups
 LEVEL_UP_BASE = 200
 LEVEL_UP_FACTOR = 150
@@ -51,31 +86,79 @@ FOV_ALGO = 0  #default FOV algorithm
 FOV_LIGHT_WALLS = True  #light walls or not
 TORCH_RADIUS = 10
 
+FLOW_RADIUS = 2 * TORCH_RADIUS  #how far around the player monsters can find their way to it
+
+#the map is stored in chunks (see chunkmap.py). the ones the camera shows, or this close to the
+#player, are kept unpacked, and the FOV map covers them; the ones further away are packed away
+RESIDENT_MARGIN = FLOW_RADIUS + 2
+
 LIMIT_FPS = 20  #20 frames-per-second maximum
 
+SAVE_FILE = 'savegame'
+SAVE_VERSION = 9  #bump whenever the save file layout changes
+AUTOSAVE_TURNS = 100  #autosave this often, and on every new level
+LEVEL_CACHE_SIZE = 8  #levels kept in memory; the rest of the visited levels are moved to disk
+FOV_CACHE_SIZE = 512  #player positions whose FOV is remembered
+
 
 color_dark_wall = libtcod.Color(0, 0, 100)
 color_light_wall = libtcod.Color(130, 110, 50)
 color_dark_ground = libtcod.Color(50, 50, 150)
 color_light_ground = libtcod.Color(200, 180, 50)
 
+#when set, menus and targeting ask this object instead of waiting for the player (see headless.py)
+policy = None
+
+#saves are written out on a worker thread. autosaves go to this file, or nowhere if it's None
+save_writer = savefile.BackgroundWriter()
+autosave_file = SAVE_FILE
+
+#the map tile shown in the top left corner of the map console
+camera_x = 0
+camera_y = 0
+
+#the FOV map only covers the resident chunks: these are the chunks, the part of the map it covers
+#and its array of visible tiles (indexed [y - fov_y, x - fov_x])
+fov_chunks = None
+fov_x = 0
+fov_y = 0
+fov_width = 0
+fov_height = 0
+fov_visible = None
+
+#the box around the player that was lit the last time the FOV was computed (see recompute_fov)
+fov_box = None
+
+#the levels the player has visited and left
+levels = LevelStore(LEVEL_CACHE_SIZE)
+
+#the FOV from the positions the player stood on lately, on any level of this game (see recompute_fov)
+fov_cache = FovCache(FOV_CACHE_SIZE)
 
-class Tile:
-    #a tile of the map and its properties
-    def __init__(self, blocked, block_sight = None, objects=[]):
-        self.blocked = blocked
+#the current level's objects that came from generating it, with their index in generation order
+#and their record as generated. levels are saved as a delta against these (see write_level)
+generated = {}
 
-        self.objects = objects
+#the changes to the current level's terrain since it was generated (see set_terrain), saved with it
+terrain_changes = []
 
-        #all tiles start unexplored
-        self.explored = False
+#the level below is generated ahead of time on a worker thread, so going down the stairs
+#doesn't have to wait for it. these are its futures by seed (see pregenerate_next_level)
+level_generator = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+pregenerated = {}
+pregenerate = True
+
+#the game's random streams by subsystem, seeded from the game seed and saved with the game
+#(levels are generated from streams of their own, see NewLevel). each stream is seeded from its
+#name, so adding one later doesn't shift the others
+GAME_STREAMS = ('ai',)
+streams = {}
 
-        #by default, if a tile is blocked, it also blocks sight
-        if block_sight is None: block_sight = blocked
-        self.block_sight = block_sight
 
 class Rect:
     #a rectangle on the map. used to characterize a room.
+    __slots__ = ('x1', 'y1', 'x2', 'y2')
+
     def __init__(self, x, y, w, h):
         self.x1 = x
         self.y1 = y
@@ -83,8 +166,8 @@ class Rect:
         self.y2 = y + h
 
     def center(self):
-        center_x = (self.x1 + self.x2) / 2
-        center_y = (self.y1 + self.y2) / 2
+        center_x = (self.x1 + self.x2) // 2
+        center_y = (self.y1 + self.y2) // 2
         return (center_x, center_y)
 
     def intersect(self, other):
@@ -95,6 +178,11 @@ class Rect:
 class Object:
     #this is a generic object: the player, a monster, an item, the stairs...
     #it's always represented by a character on screen.
+    #the classes of objects and their components have __slots__ instead of a __dict__, which
+    #makes them smaller and quicker to read from (see monster_bytes in bench.py)
+    __slots__ = ('x', 'y', 'char', 'name', 'color', 'blocks', 'always_visible', 'fighter', 'ai', 'item', 'equipment',
+                 'level')  #only the player has an experience level
+
     def __init__(self, x, y, char, name, color, blocks=False, always_visible=False, fighter=None, ai=None, item=None, equipment=None):
         self.x = x
         self.y = y
@@ -128,6 +216,7 @@ class Object:
         if not is_blocked(self.x + dx, self.y + dy):
             self.x += dx
             self.y += dy
+            occupancy.move(self, self.x - dx, self.y - dy)
 
     def move_towards(self, target_x, target_y):
         #vector from this object to the target, and distance
@@ -156,19 +245,22 @@ class Object:
         global objects
         objects.remove(self)
         objects.insert(0, self)
+        occupancy.send_to_back(self)
 
     def draw(self):
-        #set the color and then draw the character that represents this object at its position
+        #set the color and then draw the character that represents this object at its position (through the camera)
         libtcod.console_set_default_foreground(con, self.color)
-        libtcod.console_put_char(con, self.x, self.y, self.char, libtcod.BKGND_NONE)
+        libtcod.console_put_char(con, self.x - camera_x, self.y - camera_y, self.char, libtcod.BKGND_NONE)
 
     def clear(self):
         #erase the character that represents this object
-        libtcod.console_put_char(con, self.x, self.y, ' ', libtcod.BKGND_NONE)
+        libtcod.console_put_char(con, self.x - camera_x, self.y - camera_y, ' ', libtcod.BKGND_NONE)
 
 
 class Fighter:
     #combat-related properties and methods (monster, player, NPC).
+    __slots__ = ('owner', 'base_max_hp', 'hp', 'base_defense', 'base_power', 'xp', 'death_function', 'slots', 'bonuses')
+
     def __init__(self, hp, defense, power, xp, death_function=None):
         self.base_max_hp = hp
         self.hp = hp
@@ -176,26 +268,40 @@ class Fighter:
         self.base_power = power
         self.xp = xp
         self.death_function = death_function
+        self.slots = {}  #what is equipped in each slot, by slot name
+        self.bonuses = None  #(power, defense, max_hp) bonuses from equipped items, summed up when needed
+
+    def get_bonuses(self):
+        #sum up the bonuses from all equipped items, unless they're already known
+        if self.bonuses is None:
+            equipped = get_all_equipped(self.owner)
+            self.bonuses = (sum(equipment.power_bonus for equipment in equipped),
+                            sum(equipment.defense_bonus for equipment in equipped),
+                            sum(equipment.max_hp_bonus for equipment in equipped))
+        return self.bonuses
+
+    def equipment_changed(self):
+        #something was equipped or dequipped, so the bonuses must be summed up again
+        self.bonuses = None
 
     @property
-    def power(self):  #return actual power, by summing up the bonuses from all equipped items
-        bonus = sum(equipment.power_bonus for equipment in get_all_equipped(self.owner))
-        return self.base_power + bonus
+    def power(self):  #return actual power, by adding the bonuses from all equipped items
+        return self.base_power + self.get_bonuses()[0]
 
     @property
-    def defense(self):  #return actual defense, by summing up the bonuses from all equipped items
-        bonus = sum(equipment.defense_bonus for equipment in get_all_equipped(self.owner))
-        return self.base_defense + bonus
+    def defense(self):  #return actual defense, by adding the bonuses from all equipped items
+        return self.base_defense + self.get_bonuses()[1]
 
     @property
-    def max_hp(self):  #return actual max_hp, by summing up the bonuses from all equipped items
-        bonus = sum(equipment.max_hp_bonus for equipment in get_all_equipped(self.owner))
-        return self.base_max_hp + bonus
+    def max_hp(self):  #return actual max_hp, by adding the bonuses from all equipped items
+        return self.base_max_hp + self.get_bonuses()[2]
 
     def attack(self, target):
         #a simple formula for attack damage
-        damage = self.power - target.fighter.defense
+        self.strike(target, self.power - target.fighter.defense)
 
+    def strike(self, target, damage):
+        #hit the target for damage that was worked out already (by attack, or a batch of monsters)
         if damage > 0:
             #make the target take some damage
             message(self.owner.name.capitalize() + ' attacks ' + target.name + ' for ' + str(damage) + ' hit points.')
@@ -225,14 +331,20 @@ class Fighter:
 
 class BasicMonster:
     #AI for a basic monster.
+    __slots__ = ('owner',)
+
     def take_turn(self):
         #a basic monster takes its turn. if you can see it, it can see you
         monster = self.owner
-        if libtcod.map_is_in_fov(fov_map, monster.x, monster.y):
+        if in_fov(monster.x, monster.y):
 
-            #move towards player if far away
+            #move towards player if far away, finding the way around walls
             if monster.distance_to(player) >= 2:
-                monster.move_towards(player.x, player.y)
+                step = get_player_flow_field().next_step(monster.x, monster.y, is_blocked)
+                if step is not None:
+                    monster.move(step[0], step[1])
+                else:
+                    monster.move_towards(player.x, player.y)
 
             #close enough, attack! (if the player is still alive.)
             elif player.fighter.hp > 0:
@@ -240,6 +352,8 @@ class BasicMonster:
 
 class ConfusedMonster:
     #AI for a temporarily confused monster (reverts to previous AI after a while).
+    __slots__ = ('owner', 'old_ai', 'num_turns')
+
     def __init__(self, old_ai, num_turns=CONFUSE_NUM_TURNS):
         self.old_ai = old_ai
         self.num_turns = num_turns
@@ -247,7 +361,7 @@ class ConfusedMonster:
     def take_turn(self):
         if self.num_turns > 0:  #still confused...
             #move in a random direction, and decrease the number of turns confused
-            self.owner.move(libtcod.random_get_int(0, -1, 1), libtcod.random_get_int(0, -1, 1))
+            self.owner.move(streams['ai'].randint(-1, 1), streams['ai'].randint(-1, 1))
             self.num_turns -= 1
 
         else:  #restore the previous AI (this one will be deleted because it's not referenced anymore)
@@ -256,6 +370,8 @@ class ConfusedMonster:
 
 class Item:
     #an item that can be picked up and used.
+    __slots__ = ('owner', 'use_function')
+
     def __init__(self, use_function=None):
         self.use_function = use_function
 
@@ -266,6 +382,7 @@ class Item:
         else:
             inventory.append(self.owner)
             objects.remove(self.owner)
+            occupancy.remove(self.owner)
             message('You picked up a ' + self.owner.name + '!', libtcod.green)
 
             #special case: automatically equip, if the corresponding equipment slot is unused
@@ -283,6 +400,7 @@ class Item:
         inventory.remove(self.owner)
         self.owner.x = player.x
         self.owner.y = player.y
+        occupancy.add(self.owner)
         message('You dropped a ' + self.owner.name + '.', libtcod.yellow)
 
     def use(self):
@@ -300,6 +418,8 @@ class Item:
 
 class Equipment:
     #an object that can be equipped, yielding bonuses. automatically adds the Item component.
+    __slots__ = ('owner', 'power_bonus', 'defense_bonus', 'max_hp_bonus', 'slot', 'is_equipped', 'wearer')
+
     def __init__(self, slot, power_bonus=0, defense_bonus=0, max_hp_bonus=0):
         self.power_bonus = power_bonus
         self.defense_bonus = defense_bonus
@@ -307,6 +427,7 @@ class Equipment:
 
         self.slot = slot
         self.is_equipped = False
+        self.wearer = None  #the object that has it equipped
 
     def toggle_equip(self):  #toggle equip/dequip status
         if self.is_equipped:
@@ -314,95 +435,127 @@ class Equipment:
         else:
             self.equip()
 
-    def equip(self):
+    def equip(self, wearer=None):
+        #equip on the player, unless another wearer (such as a monster) is given
+        if wearer is None:
+            wearer = player
+
         #if the slot is already being used, dequip whatever is there first
-        old_equipment = get_equipped_in_slot(self.slot)
+        old_equipment = get_equipped_in_slot(self.slot, wearer)
         if old_equipment is not None:
             old_equipment.dequip()
 
         #equip object and show a message about it
+        wearer.fighter.slots[self.slot] = self
+        wearer.fighter.equipment_changed()
+        self.wearer = wearer
         self.is_equipped = True
-        message('Equipped ' + self.owner.name + ' on ' + self.slot + '.', libtcod.light_green)
+        if wearer == player:
+            message('Equipped ' + self.owner.name + ' on ' + self.slot + '.', libtcod.light_green)
 
     def dequip(self):
         #dequip object and show a message about it
         if not self.is_equipped: return
+        wearer = self.wearer
+        del wearer.fighter.slots[self.slot]
+        wearer.fighter.equipment_changed()
+        self.wearer = None
         self.is_equipped = False
-        message('Dequipped ' + self.owner.name + ' from ' + self.slot + '.', libtcod.light_yellow)
+        if wearer == player:
+            message('Dequipped ' + self.owner.name + ' from ' + self.slot + '.', libtcod.light_yellow)
 
 
-def get_equipped_in_slot(slot):  #returns the equipment in a slot, or None if it's empty
-    for obj in inventory:
-        if obj.equipment and obj.equipment.slot == slot and obj.equipment.is_equipped:
-            return obj.equipment
-    return None
+def get_equipped_in_slot(slot, obj=None):  #returns the equipment in a slot (of the player by default), or None if it's empty
+    if obj is None:
+        obj = player
+    return obj.fighter.slots.get(slot)
 
 def get_all_equipped(obj):  #returns a list of equipped items
-    if obj == player:
-        equipped_list = []
-        for item in inventory:
-            if item.equipment and item.equipment.is_equipped:
-                equipped_list.append(item.equipment)
-        return equipped_list
-    else:
-        return []  #other objects have no equipment
+    if obj.fighter is None:
+        return []  #corpses and items have no equipment
+    return list(obj.fighter.slots.values())
+
 
+def get_player_flow_field():
+    #walking distances to the player, shared by all monsters. it's only computed again after the player moved
+    global player_flow_field
+    if player_flow_field is None or (player_flow_field.x, player_flow_field.y) != (player.x, player.y):
+        (x1, y1) = (max(0, player.x - FLOW_RADIUS), max(0, player.y - FLOW_RADIUS))
+        (x2, y2) = (min(map.width, player.x + FLOW_RADIUS + 1), min(map.height, player.y + FLOW_RADIUS + 1))
+        player_flow_field = FlowField(map.window('blocked', x1, y1, x2, y2), player.x, player.y, FLOW_RADIUS,
+                                      origin=(x1, y1))
+    return player_flow_field
 
 def is_blocked(x, y):
     #first test the map tile
-    if map[x][y].blocked:
+    if map.get('blocked', x, y):
         return True
 
-    #now check for any blocking objects
-    for object in objects:
-        if object.blocks and object.x == x and object.y == y:
-            return True
-
-    return False
+    #now check for any blocking objects on that tile
+    return occupancy.is_blocked(x, y)
 
-def create_room(room):
-    global map
-    #go through the tiles in the rectangle and make them passable
-    for x in range(room.x1 + 1, room.x2):
-        for y in range(room.y1 + 1, room.y2):
-            map[x][y].blocked = False
-            map[x][y].block_sight = False
+def create_room(map, room):
+    #make the tiles inside the rectangle passable
+    map.dig(room.x1 + 1, room.y1 + 1, room.x2, room.y2)
 
-def create_h_tunnel(x1, x2, y):
-    global map
+def create_h_tunnel(map, x1, x2, y):
     #horizontal tunnel. min() and max() are used in case x1>x2
-    for x in range(min(x1, x2), max(x1, x2) + 1):
-        map[x][y].blocked = False
-        map[x][y].block_sight = False
+    map.dig(min(x1, x2), y, max(x1, x2) + 1, y + 1)
 
-def create_v_tunnel(y1, y2, x):
-    global map
+def create_v_tunnel(map, y1, y2, x):
     #vertical tunnel
-    for y in range(min(y1, y2), max(y1, y2) + 1):
-        map[x][y].blocked = False
-        map[x][y].block_sight = False
-
-def make_map():
-    global map, objects, stairs
-
-    #the list of objects with just the player
-    objects = [player]
-
-    #fill map with "blocked" tiles
-    map = [[ Tile(True)
-             for y in range(MAP_HEIGHT) ]
-           for x in range(MAP_WIDTH) ]
+    map.dig(x, min(y1, y2), x + 1, max(y1, y2) + 1)
+
+class NewLevel:
+    #a level being generated. it's kept apart from the globals of the level being played (and has
+    #its own random streams), so the next level can be generated ahead of time on a worker thread.
+    #the rooms and the monsters and items in them are drawn from separate streams, so changing
+    #the spawn tables doesn't move the rooms around
+    def __init__(self, number, seed):
+        self.number = number
+        self.map_rng = RandomStream(stream_seed(seed, 'map'))
+        self.spawn_rng = RandomStream(stream_seed(seed, 'spawn'))
+        self.map = ChunkedTileMap(MAP_WIDTH, MAP_HEIGHT)
+        self.objects = []
+        self.occupancy = OccupancyIndex()
+        self.start = None
+        self.stairs = None
+        self.upstairs = None
+        self.records = None
+
+    def add(self, obj):
+        self.objects.append(obj)
+        self.occupancy.add(obj)
+
+    def add_to_back(self, obj):
+        #add an object below all others, like Object.send_to_back
+        self.add(obj)
+        self.objects.remove(obj)
+        self.objects.insert(0, obj)
+        self.occupancy.send_to_back(obj)
+
+    def is_blocked(self, x, y):
+        #like is_blocked(), with the player's starting tile already taken
+        return self.map.get('blocked', x, y) or (x, y) == self.start or self.occupancy.is_blocked(x, y)
+
+def level_seed(number):
+    #every level of a game has its own seed, so it comes out the same whenever it's generated
+    return (game_seed * 1000003 + number) % 0x80000000
+
+def generate_level(number, seed):
+    #generate a dungeon level, returning it as a NewLevel
+    level = NewLevel(number, seed)
 
     rooms = []
     num_rooms = 0
 
     for r in range(MAX_ROOMS):
         #random width and height
-        w = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
-        h = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+        w = level.map_rng.randint(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+        h = level.map_rng.randint(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
         #random position without going out of the boundaries of the map
-        x = libtcod.random_get_int(0, 0, MAP_WIDTH - w - 1)
-        y = libtcod.random_get_int(0, 0, MAP_HEIGHT - h - 1)
+        x = level.map_rng.randint(0, MAP_WIDTH - w - 1)
+        y = level.map_rng.randint(0, MAP_HEIGHT - h - 1)
 
         #"Rect" class makes rectangles easier to work with
         new_room = Rect(x, y, w, h)
@@ -418,15 +571,19 @@ def make_map():
             #this means there are no intersections, so this room is valid
 
             #"paint" it to the map's tiles
-            create_room(new_room)
+            create_room(level.map, new_room)
 
             #center coordinates of new room, will be useful later
             (new_x, new_y) = new_room.center()
 
             if num_rooms == 0:
                 #this is the first room, where the player starts at
-                player.x = new_x
-                player.y = new_y
+                level.start = (new_x, new_y)
+
+                #below the first level, stairs lead back up from where the player arrives
+                if number > 1:
+                    level.upstairs = Object(new_x, new_y, '>', 'stairs up', libtcod.white, always_visible=True)
+                    level.add_to_back(level.upstairs)
             else:
                 #all rooms after the first:
                 #connect it to the previous room with a tunnel
@@ -435,153 +592,94 @@ def make_map():
                 (prev_x, prev_y) = rooms[num_rooms-1].center()
 
                 #draw a coin (random number that is either 0 or 1)
-                if libtcod.random_get_int(0, 0, 1) == 1:
+                if level.map_rng.randint(0, 1) == 1:
                     #first move horizontally, then vertically
-                    create_h_tunnel(prev_x, new_x, prev_y)
-                    create_v_tunnel(prev_y, new_y, new_x)
+                    create_h_tunnel(level.map, prev_x, new_x, prev_y)
+                    create_v_tunnel(level.map, prev_y, new_y, new_x)
                 else:
                     #first move vertically, then horizontally
-                    create_v_tunnel(prev_y, new_y, prev_x)
-                    create_h_tunnel(prev_x, new_x, new_y)
+                    create_v_tunnel(level.map, prev_y, new_y, prev_x)
+                    create_h_tunnel(level.map, prev_x, new_x, new_y)
 
             #add some contents to this room, such as monsters
-            place_objects(new_room)
+            place_objects(level, new_room)
 
             #finally, append the new room to the list
             rooms.append(new_room)
             num_rooms += 1
 
     #create stairs at the center of the last room
-    stairs = Object(new_x, new_y, '<', 'stairs', libtcod.white, always_visible=True)
-    objects.append(stairs)
-    stairs.send_to_back()  #so it's drawn below the monsters
-
-def random_choice_index(chances):  #choose one option from list of chances, returning its index
-    #the dice will land on some number between 1 and the sum of the chances
-    dice = libtcod.random_get_int(0, 1, sum(chances))
-
-    #go through all chances, keeping the sum so far
-    running_sum = 0
-    choice = 0
-    for w in chances:
-        running_sum += w
-
-        #see if the dice landed in the part that corresponds to this choice
-        if dice <= running_sum:
-            return choice
-        choice += 1
-
-def random_choice(chances_dict):
-    #choose one option from dictionary of chances, returning its key
-    chances = chances_dict.values()
-    strings = chances_dict.keys()
-
-    return strings[random_choice_index(chances)]
-
-def from_dungeon_level(table):
-    #returns a value that depends on level. the table specifies what value occurs after each level, default is 0.
-    for (value, level) in reversed(table):
-        if dungeon_level >= level:
-            return value
-    return 0
-
-def place_objects(room):
-    #this is where we decide the chance of each monster or item appearing.
-
-    #maximum number of monsters per room
-    max_monsters = from_dungeon_level([[2, 1], [3, 4], [5, 6]])
-
-    #chance of each monster
-    monster_chances = {}
-    monster_chances['orc'] = 80  #orc always shows up, even if all other monsters have 0 chance
-    monster_chances['troll'] = from_dungeon_level([[15, 3], [30, 5], [60, 7]])
-
-    #maximum number of items per room
-    max_items = from_dungeon_level([[1, 1], [2, 4]])
-
-    #chance of each item (by default they have a chance of 0 at level 1, which then goes up)
-    item_chances = {}
-    item_chances['heal'] = 35  #healing potion always shows up, even if all other items have 0 chance
-    item_chances['lightning'] = from_dungeon_level([[25, 4]])
-    item_chances['fireball'] =  from_dungeon_level([[25, 6]])
-    item_chances['confuse'] =   from_dungeon_level([[10, 2]])
-    item_chances['sword'] =     from_dungeon_level([[5, 4]])
-    item_chances['shield'] =    from_dungeon_level([[15, 8]])
+    level.stairs = Object(new_x, new_y, '<', 'stairs', libtcod.white, always_visible=True)
+    level.add_to_back(level.stairs)  #so it's drawn below the monsters
+
+    #each object's record as generated, to tell later on which ones changed (see write_level)
+    level.records = [object_record(obj, {}) for obj in level.objects]
 
+    #placing the objects unpacked the chunks it looked at. pack them all away: a level generated
+    #ahead of time waits without any, and the current one unpacks those around the player
+    level.map.keep_resident(0, 0, 0, 0)
+    return level
+
+def make_map():
+    #make a new level the current one: the one generated ahead of time if there is one, otherwise
+    #generate it now (the same level either way, it only depends on its seed)
+    global map, objects, stairs, upstairs, occupancy, generated, terrain_changes
+
+    seed = level_seed(dungeon_level)
+    future = pregenerated.pop(seed, None)
+    if future is not None:
+        level = future.result()
+    else:
+        level = generate_level(dungeon_level, seed)
+
+    map = level.map
+    objects = level.objects
+    occupancy = level.occupancy
+    stairs = level.stairs
+    upstairs = level.upstairs
+    generated = dict((obj, (index, record)) for (index, (obj, record)) in enumerate(zip(level.objects, level.records)))
+    terrain_changes = []
+
+    (player.x, player.y) = level.start
+    objects.insert(0, player)
+    occupancy.add(player)
+
+def pregenerate_next_level():
+    #start generating the level below on the worker thread, unless it's been visited already
+    number = dungeon_level + 1
+    seed = level_seed(number)
+    if pregenerate and number not in levels and seed not in pregenerated:
+        pregenerated[seed] = level_generator.submit(generate_level, number, seed)
+
+def place_objects(level, room):
+    #this is where we decide the chance of each monster or item appearing (see SPAWN_TABLES)
+    spawns = SPAWN_TABLES.level(level.number)
 
     #choose random number of monsters
-    num_monsters = libtcod.random_get_int(0, 0, max_monsters)
+    num_monsters = level.spawn_rng.randint(0, spawns.max_monsters)
 
     for i in range(num_monsters):
         #choose random spot for this monster
-        x = libtcod.random_get_int(0, room.x1+1, room.x2-1)
-        y = libtcod.random_get_int(0, room.y1+1, room.y2-1)
+        x = level.spawn_rng.randint(room.x1+1, room.x2-1)
+        y = level.spawn_rng.randint(room.y1+1, room.y2-1)
 
         #only place it if the tile is not blocked
-        if not is_blocked(x, y):
-            choice = random_choice(monster_chances)
-            if choice == 'orc':
-                #create an orc
-                fighter_component = Fighter(hp=20, defense=0, power=4, xp=35, death_function=monster_death)
-                ai_component = BasicMonster()
-
-                monster = Object(x, y, 'o', 'orc', libtcod.desaturated_green,
-                                 blocks=True, fighter=fighter_component, ai=ai_component)
-
-            elif choice == 'troll':
-                #create a troll
-                fighter_component = Fighter(hp=30, defense=2, power=8, xp=100, death_function=monster_death)
-                ai_component = BasicMonster()
-
-                monster = Object(x, y, 'T', 'troll', libtcod.darker_green,
-                                 blocks=True, fighter=fighter_component, ai=ai_component)
-
-            objects.append(monster)
+        if not level.is_blocked(x, y):
+            monster = TEMPLATES.spawn(spawns.monsters.sample(level.spawn_rng), x, y)
+            level.add(monster)
 
     #choose random number of items
-    num_items = libtcod.random_get_int(0, 0, max_items)
+    num_items = level.spawn_rng.randint(0, spawns.max_items)
 
     for i in range(num_items):
         #choose random spot for this item
-        x = libtcod.random_get_int(0, room.x1+1, room.x2-1)
-        y = libtcod.random_get_int(0, room.y1+1, room.y2-1)
+        x = level.spawn_rng.randint(room.x1+1, room.x2-1)
+        y = level.spawn_rng.randint(room.y1+1, room.y2-1)
 
         #only place it if the tile is not blocked
-        if not is_blocked(x, y):
-            choice = random_choice(item_chances)
-            if choice == 'heal':
-                #create a healing potion
-                item_component = Item(use_function=cast_heal)
-                item = Object(x, y, '!', 'healing potion', libtcod.violet, item=item_component)
-
-            elif choice == 'lightning':
-                #create a lightning bolt scroll
-                item_component = Item(use_function=cast_lightning)
-                item = Object(x, y, '#', 'scroll of lightning bolt', libtcod.light_yellow, item=item_component)
-
-            elif choice == 'fireball':
-                #create a fireball scroll
-                item_component = Item(use_function=cast_fireball)
-                item = Object(x, y, '#', 'scroll of fireball', libtcod.light_yellow, item=item_component)
-
-            elif choice == 'confuse':
-                #create a confuse scroll
-                item_component = Item(use_function=cast_confuse)
-                item = Object(x, y, '#', 'scroll of confusion', libtcod.light_yellow, item=item_component)
-
-            elif choice == 'sword':
-                #create a sword
-                equipment_component = Equipment(slot='right hand', power_bonus=3)
-                item = Object(x, y, '/', 'sword', libtcod.sky, equipment=equipment_component)
-
-            elif choice == 'shield':
-                #create a shield
-                equipment_component = Equipment(slot='left hand', defense_bonus=1)
-                item = Object(x, y, '[', 'shield', libtcod.darker_orange, equipment=equipment_component)
-
-            objects.append(item)
-            item.send_to_back()  #items appear below other objects
-            item.always_visible = True  #items are visible even out-of-FOV, if in an explored area
+        if not level.is_blocked(x, y):
+            item = TEMPLATES.spawn(spawns.items.sample(level.spawn_rng), x, y)
+            level.add_to_back(item)  #items appear below other objects
 
 
 def render_bar(x, y, total_width, name, value, maximum, bar_color, back_color):
@@ -599,105 +697,262 @@ def render_bar(x, y, total_width, name, value, maximum, bar_color, back_color):
 
     #finally, some centered text with the values
     libtcod.console_set_default_foreground(panel, libtcod.white)
-    libtcod.console_print_ex(panel, x + total_width / 2, y, libtcod.BKGND_NONE, libtcod.CENTER,
+    libtcod.console_print_ex(panel, x + total_width // 2, y, libtcod.BKGND_NONE, libtcod.CENTER,
                                  name + ': ' + str(value) + '/' + str(maximum))
 
+def tile_under_mouse():
+    #the map coordinates of the tile under the mouse, through the camera, or (None, None) if the
+    #mouse isn't over the map
+    (x, y) = (mouse.cx + camera_x, mouse.cy + camera_y)
+    if mouse.cx < CAMERA_WIDTH and mouse.cy < CAMERA_HEIGHT and 0 <= x < map.width and 0 <= y < map.height:
+        return (x, y)
+    return (None, None)
+
 def get_names_under_mouse():
     global mouse
     #return a string with the names of all objects under the mouse
 
-    (x, y) = (mouse.cx, mouse.cy)
+    (x, y) = tile_under_mouse()
+    if x is None:
+        return ''
 
     #create a list with the names of all objects at the mouse's coordinates and in FOV
-    names = [obj.name for obj in objects
-             if obj.x == x and obj.y == y and libtcod.map_is_in_fov(fov_map, obj.x, obj.y)]
+    names = [obj.name for obj in occupancy.at(x, y)
+             if in_fov(obj.x, obj.y)]
 
     names = ', '.join(names)  #join the names, separated by commas
     return names.capitalize()
 
-def nethack_render():
-    global fov_map, color_dark_wall, color_light_wall
-    global color_dark_ground, color_light_ground
-    global fov_recompute
+def map_cell_palette(style):
+    #characters, foreground and background colors for each kind of map cell, numbered
+    #0 unexplored, 1 dark ground, 2 dark wall, 3 light ground, 4 light wall
+    if style == 'nethack':
+        chars = ' .#.#'
+        fore = [libtcod.white, libtcod.grey, libtcod.white, libtcod.white, libtcod.white]
+        back = [libtcod.black] * 5
+    else:
+        chars = '     '
+        fore = [libtcod.white] * 5
+        back = [libtcod.black, color_dark_ground, color_dark_wall, color_light_ground, color_light_wall]
+
+    return (numpy.array([ord(c) for c in chars]), numpy.array(fore, dtype=numpy.uint8),
+            numpy.array(back, dtype=numpy.uint8))
+
+def in_fov(x, y):
+    #whether a map tile is in the player's FOV (nothing outside the FOV map is)
+    (x, y) = (x - fov_x, y - fov_y)
+    return 0 <= x < fov_width and 0 <= y < fov_height and bool(fov_visible[y, x])
+
+def visible_at(xs, ys):
+    #in_fov() for arrays of map coordinates, as a boolean array
+    (xs, ys) = (xs - fov_x, ys - fov_y)
+    inside = (xs >= 0) & (xs < fov_width) & (ys >= 0) & (ys < fov_height)
+    visible = numpy.zeros(len(xs), dtype=bool)
+    visible[inside] = fov_visible[ys[inside], xs[inside]]
+    return visible
+
+def update_resident_chunks():
+    #keep the chunks the camera shows and the ones near the player resident, and pack away the
+    #rest. when that changes, the FOV map is made again to cover the resident chunks
+    global fov_chunks, fov_map, fov_x, fov_y, fov_width, fov_height, fov_visible, fov_recompute
+    (x, y) = camera_position()
+    chunks = map.chunks_in(min(x, player.x - RESIDENT_MARGIN), min(y, player.y - RESIDENT_MARGIN),
+                           max(x + CAMERA_WIDTH, player.x + RESIDENT_MARGIN + 1),
+                           max(y + CAMERA_HEIGHT, player.y + RESIDENT_MARGIN + 1))
+    if chunks == fov_chunks:
+        return
+    fov_chunks = chunks
+
+    #the chunks right next to them are kept too, so walking back and forth over the edge of a
+    #chunk doesn't pack and unpack the same ones every time
+    (cx1, cy1, cx2, cy2) = chunks
+    map.keep_resident(cx1 - 1, cy1 - 1, cx2 + 1, cy2 + 1)
+
+    #create the FOV map, according to the resident part of the map. its arrays are indexed [y, x],
+    #so the map's layers are copied in transposed, all at once
+    (fov_x, fov_y) = (cx1 * map.chunk_size, cy1 * map.chunk_size)
+    (x2, y2) = (min(cx2 * map.chunk_size, map.width), min(cy2 * map.chunk_size, map.height))
+    (fov_width, fov_height) = (x2 - fov_x, y2 - fov_y)
+    fov_map = libtcod.map_new(fov_width, fov_height)
+    fov_map.transparent[:] = ~map.window('block_sight', fov_x, fov_y, x2, y2).T
+    fov_map.walkable[:] = ~map.window('blocked', fov_x, fov_y, x2, y2).T
+    fov_visible = fov_map.fov
+    fov_recompute = True
 
+def set_terrain(x1, y1, x2, y2, blocked, block_sight):
+    #change the terrain in the rectangle [x1, x2) x [y1, y2) of the current level, when digging,
+    #opening or closing a door, knocking down a wall... only the tiles it covers are updated, in
+    #the map and in the FOV map (if they're on it)
+    global fov_recompute, player_flow_field, drawn_style
+    map.fill(x1, y1, x2, y2, blocked, block_sight)
+
+    #the changes this one covers entirely are overwritten, so they needn't be saved any more
+    terrain_changes[:] = [change for change in terrain_changes
+                          if not (x1 <= change[0] and y1 <= change[1] and change[2] <= x2 and change[3] <= y2)]
+    terrain_changes.append((x1, y1, x2, y2, blocked, block_sight))
+    fov_cache.invalidate(dungeon_level, x1, y1, x2, y2)
+
+    (a1, b1) = (max(x1, fov_x) - fov_x, max(y1, fov_y) - fov_y)
+    (a2, b2) = (min(x2, fov_x + fov_width) - fov_x, min(y2, fov_y + fov_height) - fov_y)
+    if a1 < a2 and b1 < b2:
+        fov_map.transparent[b1:b2, a1:a2] = not block_sight
+        fov_map.walkable[b1:b2, a1:a2] = not blocked
+
+    #what the player sees, and the ways to get to them, may have changed. tiles may look different
+    #anywhere in view, so it's all drawn again
+    fov_recompute = True
+    player_flow_field = None
+    drawn_style = None
+
+def recompute_fov():
+    #compute the player's FOV, and explore everything in it. nothing further than TORCH_RADIUS from
+    #the player can be lit, so the FOV is only computed in that box (fov_box), after putting out the
+    #box lit last time. returns the part of the map where what's visible may have changed, as
+    #(x1, y1, x2, y2): both boxes
+    global fov_recompute, fov_box
+    update_resident_chunks()
+    fov_recompute = False
+
+    #put out the tiles lit last time, if the FOV map still covers them
+    if fov_box is not None:
+        (x1, y1, x2, y2) = fov_box
+        fov_visible[max(y1 - fov_y, 0):max(y2 - fov_y, 0), max(x1 - fov_x, 0):max(x2 - fov_x, 0)] = False
+
+    #light the box around the player (a radius of 0 has no limit, so that's the whole FOV map).
+    #if the player stood here before, it's lit just like last time, unless the terrain around
+    #changed since (see set_terrain). it's all explored already, too
+    key = (dungeon_level, player.x, player.y, TORCH_RADIUS, FOV_ALGO, FOV_LIGHT_WALLS)
+    cached = fov_cache.get(key)
+    if cached is not None:
+        ((x1, y1, x2, y2), lit) = cached
+    else:
+        radius = TORCH_RADIUS or max(fov_width, fov_height)
+        (x1, y1) = (max(player.x - radius, fov_x), max(player.y - radius, fov_y))
+        (x2, y2) = (min(player.x + radius + 1, fov_x + fov_width), min(player.y + radius + 1, fov_y + fov_height))
+        lit = tcod.map.compute_fov(fov_map.transparent[y1 - fov_y:y2 - fov_y, x1 - fov_x:x2 - fov_x],
+                                   (player.y - y1, player.x - x1), TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
+        fov_cache.put(key, (x1, y1, x2, y2), lit)
+
+        #since it's visible, explore it
+        map.explore(x1, y1, lit.T)
+    fov_visible[y1 - fov_y:y2 - fov_y, x1 - fov_x:x2 - fov_x] = lit
+
+    (old_box, fov_box) = (fov_box, (x1, y1, x2, y2))
+    if old_box is None:
+        return fov_box
+    return (min(old_box[0], x1), min(old_box[1], y1), max(old_box[2], x2), max(old_box[3], y2))
+
+def camera_position():
+    #where the camera goes to keep the player in the middle, without showing anything past the
+    #edges of the map
+    x = min(max(player.x - CAMERA_WIDTH // 2, 0), max(map.width - CAMERA_WIDTH, 0))
+    y = min(max(player.y - CAMERA_HEIGHT // 2, 0), max(map.height - CAMERA_HEIGHT, 0))
+    return (x, y)
+
+def move_camera():
+    #keep the camera on the player. returns True if it moved
+    global camera_x, camera_y
+    (x, y) = camera_position()
+    moved = (x, y) != (camera_x, camera_y)
+    (camera_x, camera_y) = (x, y)
+    return moved
+
+def render_map(style):
+    #bring "con" up to date with the part of the map the camera shows and the objects on it, only
+    #touching the cells that look different from the last time they were drawn. everything here is
+    #in console coordinates, which are map coordinates minus the camera position
+    global drawn_style, drawn_cells, drawn_objects, fov_recompute
+
+    (chars, fore, back) = map_cell_palette(style)
+
+    changed = None
+    moved = move_camera()
+    (x1, y1) = (camera_x, camera_y)
+    (x2, y2) = (min(x1 + CAMERA_WIDTH, map.width), min(y1 + CAMERA_HEIGHT, map.height))
+
+    #the part of the map whose cells may look different, as (x1, y1, x2, y2): all of the view if
+    #the camera moved, otherwise only where the FOV changed
+    redraw = (x1, y1, x2, y2) if moved else None
+    if style != drawn_style:
+        #first frame on this map, or the other renderer drew last: start from a blank console
+        libtcod.console_clear(con)
+        drawn_style = style
+        drawn_cells = numpy.zeros((x2 - x1, y2 - y1), dtype=numpy.int8)
+        drawn_objects = {}
+        fov_recompute = True
+        redraw = (x1, y1, x2, y2)
+
+    update_resident_chunks()  #the camera only shows resident chunks, which the FOV map covers
     if fov_recompute:
         #recompute FOV if needed (the player moved or something)
-        fov_recompute = False
-        libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
-
-        #go through all tiles, and set their background color according to the FOV
-        for y in range(MAP_HEIGHT):
-            for x in range(MAP_WIDTH):
-                visible = libtcod.map_is_in_fov(fov_map, x, y)
-                wall = map[x][y].block_sight
-                if not visible:
-                    #if it's not visible right now, the player can only see it if it's explored
-                    if map[x][y].explored:
-                        if wall:
-                            libtcod.console_put_char_ex(con, x, y, '#', libtcod.white, libtcod.black)
-                        else:
-                            libtcod.console_put_char_ex(con, x, y, '.', libtcod.grey, libtcod.black)
-                else:
-                    #it's visible
-                    if wall:
-                        libtcod.console_put_char_ex(con, x, y, '#', libtcod.white, libtcod.black)
-                    else:
-                        libtcod.console_put_char_ex(con, x, y, '.', libtcod.white, libtcod.black)
-                        #since it's visible, explore it
-                    map[x][y].explored = True
-            for object in objects:
-                #only show if it's visible to the player; or it's set to "always visible" and on an explored tile
-                if (libtcod.map_is_in_fov(fov_map, object.x, object.y) or
-                    (object.always_visible and map[object.x][object.y].explored)):
-                    object.draw()
+        lit = recompute_fov()
+        if redraw is None:
+            redraw = lit
+
+    if redraw is not None:
+        #work out the kind of every cell in that part of the view, and redraw only the ones that
+        #changed since last time. (a1, b1) to (a2, b2) is that part, in console coordinates
+        (a1, b1) = (max(redraw[0], x1) - x1, max(redraw[1], y1) - y1)
+        (a2, b2) = (min(redraw[2], x2) - x1, min(redraw[3], y2) - y1)
+        changed = numpy.zeros(drawn_cells.shape, dtype=bool)
+        if a1 < a2 and b1 < b2:
+            (left, top) = (x1 + a1, y1 + b1)
+            (right, bottom) = (x1 + a2, y1 + b2)
+            visible = fov_visible[top - fov_y:bottom - fov_y, left - fov_x:right - fov_x].T
+            cells = (map.window('explored', left, top, right, bottom) *
+                     (1 + 2 * visible + map.window('block_sight', left, top, right, bottom)))
+            changed[a1:a2, b1:b2] = cells != drawn_cells[a1:a2, b1:b2]
+            drawn_cells[a1:a2, b1:b2] = cells
+        (xs, ys) = numpy.nonzero(changed)
+        kinds = drawn_cells[xs, ys]
+        con.ch[ys, xs] = chars[kinds]
+        con.fg[ys, xs] = fore[kinds]
+        con.bg[ys, xs] = back[kinds]
+
+    #find which object shows on each cell. the colors renderer shows all of them; the nethack one
+    #only if it's visible to the player, or it's set to "always visible" and on an explored tile.
+    #the player always goes on top
+    shown = {}
+    for object in occupancy.in_rect(x1, y1, x2, y2):
+        (x, y) = (object.x - x1, object.y - y1)
+        if object == player:
+            continue
+        if style != 'nethack' or drawn_cells[x, y] >= 3 or (object.always_visible and drawn_cells[x, y] > 0):
+            shown[(x, y)] = (object.char, tuple(object.color))
+    shown[(player.x - x1, player.y - y1)] = (player.char, tuple(player.color))
+
+    #objects that went away (moved, picked up, out of sight): put the map cell back
+    for (x, y) in drawn_objects:
+        if (x, y) not in shown:
+            kind = drawn_cells[x, y]
+            con.ch[y, x] = chars[kind]
+            con.fg[y, x] = fore[kind]
+
+    #objects that appeared, changed, or had their cell redrawn under them
+    for ((x, y), (char, color)) in shown.items():
+        if drawn_objects.get((x, y)) != (char, color) or (changed is not None and changed[x, y]):
+            libtcod.console_set_default_foreground(con, color)
+            libtcod.console_put_char(con, x, y, char, libtcod.BKGND_NONE)
+
+    drawn_objects = shown
+
+def nethack_render():
+    #draw the map with characters, like nethack
+    render_map('nethack')
 
     #blit the contents of "con" to the root console
-    libtcod.console_blit(con, 0, 0, MAP_WIDTH, MAP_HEIGHT, 0, 0, 1)
+    libtcod.console_blit(con, 0, 0, CAMERA_WIDTH, CAMERA_HEIGHT, 0, 0, 1)
 
     #print the game messages, one line at a time
     y = 1
     libtcod.console_print_ex(0, 0, 0, libtcod.BKGND_NONE, libtcod.LEFT,"Hey")
 
 def render_all():
-    global fov_map, color_dark_wall, color_light_wall
-    global color_dark_ground, color_light_ground
-    global fov_recompute
-
-    if fov_recompute:
-        #recompute FOV if needed (the player moved or something)
-        fov_recompute = False
-        libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
-
-        #go through all tiles, and set their background color according to the FOV
-        for y in range(MAP_HEIGHT):
-            for x in range(MAP_WIDTH):
-                visible = libtcod.map_is_in_fov(fov_map, x, y)
-                wall = map[x][y].block_sight
-                if not visible:
-                    #if it's not visible right now, the player can only see it if it's explored
-                    if map[x][y].explored:
-                        if wall:
-                            libtcod.console_set_char_background(con, x, y, color_dark_wall, libtcod.BKGND_SET)
-                        else:
-                            libtcod.console_set_char_background(con, x, y, color_dark_ground, libtcod.BKGND_SET)
-                else:
-                    #it's visible
-                    if wall:
-                        libtcod.console_set_char_background(con, x, y, color_light_wall, libtcod.BKGND_SET )
-                    else:
-                        libtcod.console_set_char_background(con, x, y, color_light_ground, libtcod.BKGND_SET )
-                        #since it's visible, explore it
-                    map[x][y].explored = True
-
-    #draw all objects in the list, except the player. we want it to
-    #always appear over all other objects! so it's drawn later.
-    for object in objects:
-        if object != player:
-            object.draw()
-    player.draw()
+    #draw the map with background colors, with the objects on top
+    render_map('colors')
 
     #blit the contents of "con" to the root console
-    libtcod.console_blit(con, 0, 0, MAP_WIDTH, MAP_HEIGHT, 0, 0, 0)
+    libtcod.console_blit(con, 0, 0, CAMERA_WIDTH, CAMERA_HEIGHT, 0, 0, 0)
 
 
     #prepare to render the GUI panel
@@ -746,8 +1001,8 @@ def player_move_or_attack(dx, dy):
 
     #try to find an attackable object there
     target = None
-    for object in objects:
-        if object.fighter and object.x == x and object.y == y:
+    for object in occupancy.at(x, y):
+        if object.fighter:
             target = object
             break
 
@@ -762,6 +1017,10 @@ def player_move_or_attack(dx, dy):
 def menu(header, options, width):
     if len(options) > 26: raise ValueError('Cannot have a menu with more than 26 options.')
 
+    #without a window, the choice comes from the player policy instead
+    if policy is not None:
+        return policy.choose(header, options)
+
     #calculate total height for the header (after auto-wrap) and one line per option
     header_height = libtcod.console_get_height_rect(con, 0, 0, width, SCREEN_HEIGHT, header)
     if header == '':
@@ -859,8 +1118,8 @@ def handle_keys():
 
             if key_char == 'g':
                 #pick up an item
-                for object in objects:  #look for an item in the player's tile
-                    if object.x == player.x and object.y == player.y and object.item:
+                for object in occupancy.at(player.x, player.y):  #look for an item in the player's tile
+                    if object.item:
                         object.item.pick_up()
                         break
 
@@ -884,9 +1143,11 @@ def handle_keys():
                        '\nAttack: ' + str(player.fighter.power) + '\nDefense: ' + str(player.fighter.defense), CHARACTER_SCREEN_WIDTH)
 
             if key_char == '<':
-                #go down stairs, if the player is on them
+                #take the stairs, down or back up, if the player is on them
                 if stairs.x == player.x and stairs.y == player.y:
                     next_level()
+                elif upstairs and upstairs.x == player.x and upstairs.y == player.y:
+                    previous_level()
 
             return 'didnt-take-turn'
 
@@ -928,6 +1189,17 @@ def monster_death(monster):
     #transform it into a nasty corpse! it doesn't block, can't be
     #attacked and doesn't move
     message('The ' + monster.name + ' is dead! You gain ' + str(monster.fighter.xp) + ' experience points.', libtcod.orange)
+
+    #whatever it had equipped falls to the ground
+    for equipment in get_all_equipped(monster):
+        equipment.dequip()
+        item = equipment.owner
+        (item.x, item.y) = (monster.x, monster.y)
+        item.always_visible = True
+        objects.append(item)
+        occupancy.add(item)
+        item.send_to_back()
+
     monster.char = '%'
     monster.color = libtcod.dark_red
     monster.blocks = False
@@ -939,19 +1211,22 @@ def monster_death(monster):
 def target_tile(max_range=None):
     global key, mouse
     #return the position of a tile left-clicked in player's FOV (optionally in a range), or (None,None) if right-clicked.
+    if policy is not None:
+        return policy.pick_tile(max_range)
+
     while True:
         #render the screen. this erases the inventory and shows the names of objects under the mouse.
         libtcod.console_flush()
         libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE, key, mouse)
         render_all()
 
-        (x, y) = (mouse.cx, mouse.cy)
+        (x, y) = tile_under_mouse()
 
         if mouse.rbutton_pressed or key.vk == libtcod.KEY_ESCAPE:
             return (None, None)  #cancel if the player right-clicked or pressed Escape
 
         #accept the target if the player clicked in FOV, and in case a range is specified, if it's in that range
-        if (mouse.lbutton_pressed and libtcod.map_is_in_fov(fov_map, x, y) and
+        if (mouse.lbutton_pressed and x is not None and in_fov(x, y) and
                 (max_range is None or player.distance(x, y) <= max_range)):
             return (x, y)
 
@@ -963,23 +1238,20 @@ def target_monster(max_range=None):
             return None
 
         #return the first clicked monster, otherwise continue looping
-        for obj in objects:
-            if obj.x == x and obj.y == y and obj.fighter and obj != player:
+        for obj in occupancy.at(x, y):
+            if obj.fighter and obj != player:
                 return obj
 
 def closest_monster(max_range):
-    #find closest enemy, up to a maximum range, and in the player's FOV
-    closest_enemy = None
-    closest_dist = max_range + 1  #start with (slightly more than) maximum range
-
-    for object in objects:
-        if object.fighter and not object == player and libtcod.map_is_in_fov(fov_map, object.x, object.y):
-            #calculate distance between this object and the player
-            dist = player.distance_to(object)
-            if dist < closest_dist:  #it's closer, so remember it
-                closest_enemy = object
-                closest_dist = dist
-    return closest_enemy
+    #find closest enemy, up to a maximum range (or slightly more: anything closer than max_range + 1
+    #counts, like it always has), and in the player's FOV
+    def is_enemy(obj):
+        return obj.fighter and obj != player and in_fov(obj.x, obj.y)
+
+    found = occupancy.nearest(player.x, player.y, max_range + 1, where=is_enemy)
+    if found and player.distance_to(found[0]) < max_range + 1:
+        return found[0]
+    return None
 
 def cast_heal():
     #heal the player
@@ -1009,8 +1281,8 @@ def cast_fireball():
     if x is None: return 'cancelled'
     message('The fireball explodes, burning everything within ' + str(FIREBALL_RADIUS) + ' tiles!', libtcod.orange)
 
-    for obj in objects:  #damage every fighter in range, including the player
-        if obj.distance(x, y) <= FIREBALL_RADIUS and obj.fighter:
+    for obj in occupancy.within(x, y, FIREBALL_RADIUS):  #damage every fighter in range, including the player
+        if obj.fighter:
             message('The ' + obj.name + ' gets burned for ' + str(FIREBALL_DAMAGE) + ' hit points.', libtcod.orange)
             obj.fighter.take_damage(FIREBALL_DAMAGE)
 
@@ -1027,38 +1299,298 @@ def cast_confuse():
     message('The eyes of the ' + monster.name + ' look vacant, as he starts to stumble around!', libtcod.light_green)
 
 
+#every kind of monster and item, by template name (the names the spawn tables use)
+TEMPLATES = TemplateRegistry(Object, Fighter, Item, Equipment)
+TEMPLATES.add_monsters([
+    #template  char  name      color                       hp  def  pow   xp
+    ('orc',     'o', 'orc',    libtcod.desaturated_green,  20,   0,   4,  35),
+    ('troll',   'T', 'troll',  libtcod.darker_green,       30,   2,   8, 100),
+], ai=BasicMonster, death_function=monster_death)
+TEMPLATES.add_items([
+    #template     char  name                        color                 use function
+    ('heal',       '!', 'healing potion',           libtcod.violet,       cast_heal),
+    ('lightning',  '#', 'scroll of lightning bolt', libtcod.light_yellow, cast_lightning),
+    ('fireball',   '#', 'scroll of fireball',       libtcod.light_yellow, cast_fireball),
+    ('confuse',    '#', 'scroll of confusion',      libtcod.light_yellow, cast_confuse),
+])
+TEMPLATES.add_equipment([
+    #template  char  name      color                  slot          pow  def  hp
+    ('sword',   '/', 'sword',  libtcod.sky,           'right hand',   3,   0,  0),
+    ('shield',  '[', 'shield', libtcod.darker_orange, 'left hand',    0,   1,  0),
+    ('dagger',  '-', 'dagger', libtcod.sky,           'right hand',   2,   0,  0),
+])
+
+#everything that a save file may refer to by name
+SAVED_FUNCTIONS = dict((function.__name__, function) for function in
+                       [player_death, monster_death, cast_heal, cast_lightning, cast_fireball, cast_confuse])
+AI_CLASSES = {'BasicMonster': BasicMonster, 'ConfusedMonster': ConfusedMonster}
+
+def saved_function_name(function):
+    #functions (death and item use) are saved by name
+    if function is None:
+        return ''
+    return function.__name__
+
+def write_object(file, obj, table_index):
+    #one record of the object table: the object itself, then each of its components
+    file.ints(obj.x, obj.y)
+    file.string(obj.char)
+    file.string(obj.name)
+    file.color(obj.color)
+    file.bool(obj.blocks)
+    file.bool(obj.always_visible)
+
+    file.bool(obj.fighter is not None)
+    if obj.fighter:
+        fighter = obj.fighter
+        file.ints(fighter.hp, fighter.base_max_hp, fighter.base_defense, fighter.base_power, fighter.xp)
+        file.string(saved_function_name(fighter.death_function))
+
+    file.string(obj.ai.__class__.__name__ if obj.ai else '')
+    if isinstance(obj.ai, ConfusedMonster):
+        file.int(obj.ai.num_turns)
+        file.string(obj.ai.old_ai.__class__.__name__ if obj.ai.old_ai else '')
+
+    #items that are also equipment get their Item component from the Equipment
+    file.bool(obj.item is not None and obj.equipment is None)
+    if obj.item and not obj.equipment:
+        file.string(saved_function_name(obj.item.use_function))
+
+    file.bool(obj.equipment is not None)
+    if obj.equipment:
+        equipment = obj.equipment
+        file.string(equipment.slot)
+        file.ints(equipment.power_bonus, equipment.defense_bonus, equipment.max_hp_bonus)
+        file.int(table_index[equipment.wearer] if equipment.is_equipped else -1)
+
+def read_object(file):
+    #read back one record written by write_object. returns the object and the table index of its wearer, if any
+    (x, y) = file.ints(2)
+    char = file.string()
+    name = file.string()
+    color = libtcod.Color(*file.color())
+    blocks = file.bool()
+    always_visible = file.bool()
+
+    fighter = None
+    if file.bool():
+        (hp, max_hp, defense, power, xp) = file.ints(5)
+        fighter = Fighter(hp=max_hp, defense=defense, power=power, xp=xp,
+                          death_function=SAVED_FUNCTIONS.get(file.string()))
+        fighter.hp = hp
+
+    ai = None
+    ai_name = file.string()
+    if ai_name == 'ConfusedMonster':
+        num_turns = file.int()
+        old_ai_name = file.string()
+        ai = ConfusedMonster(AI_CLASSES[old_ai_name]() if old_ai_name else None, num_turns)
+    elif ai_name:
+        ai = AI_CLASSES[ai_name]()
+
+    item = None
+    if file.bool():
+        item = Item(use_function=SAVED_FUNCTIONS.get(file.string()))
+
+    equipment = None
+    wearer_index = -1
+    if file.bool():
+        slot = file.string()
+        (power_bonus, defense_bonus, max_hp_bonus) = file.ints(3)
+        equipment = Equipment(slot, power_bonus=power_bonus, defense_bonus=defense_bonus, max_hp_bonus=max_hp_bonus)
+        wearer_index = file.int()
+
+    obj = Object(x, y, char, name, color, blocks=blocks, always_visible=always_visible,
+                 fighter=fighter, ai=ai, item=item, equipment=equipment)
+    if isinstance(ai, ConfusedMonster) and ai.old_ai:
+        ai.old_ai.owner = obj
+    return (obj, wearer_index)
+
+def object_record(obj, table_index):
+    #one object's record, as write_object would write it into the object table
+    file = savefile.Writer()
+    write_object(file, obj, table_index)
+    return file.body()
+
+def write_level(file, level_objects, held):
+    #the current level, as a delta against the level its seed generates: the level's number and
+    #seed, its explored tiles (chunk by chunk, for the chunks with any) and the changes to its
+    #terrain, then a table with the map's objects, "held" objects that aren't on the map (the
+    #inventory) and anything the monsters have equipped. objects that are just as they were
+    #generated only take their index in generation order; the ones that changed (moved, killed, ...)
+    #or weren't generated on this level are written in full, and the generated ones that are gone
+    #(picked up, ...) are simply left out. returns each object's index in the table
+    file.ints(dungeon_level, level_seed(dungeon_level))
+    explored = map.explored_chunks()
+    file.int(len(explored))
+    for (cx, cy, tiles) in explored:
+        file.ints(cx, cy)
+        file.bits(tiles)
+    file.int(len(terrain_changes))
+    for (x1, y1, x2, y2, blocked, block_sight) in terrain_changes:
+        file.ints(x1, y1, x2, y2)
+        file.bool(blocked)
+        file.bool(block_sight)
+
+    carried = [equipment.owner for obj in level_objects for equipment in get_all_equipped(obj) if obj != player]
+    table = level_objects + held + carried
+    table_index = dict((obj, index) for (index, obj) in enumerate(table))
+    file.ints(len(level_objects), len(held), len(carried))
+    for obj in table:
+        (index, generated_record) = generated.get(obj, (-1, None))
+        record = object_record(obj, table_index)
+        file.int(index)
+        file.bool(record != generated_record)
+        if record != generated_record:
+            file.raw(record)
+
+    file.ints(table_index[stairs], table_index[upstairs] if upstairs else -1)
+    return table_index
+
+def read_level(file):
+    #read back a level written by write_level(), generating it again from its seed and making it
+    #the current one. returns the held objects and the whole object table
+    global map, objects, occupancy, stairs, upstairs, generated, terrain_changes
+
+    (number, seed) = file.ints(2)
+    level = generate_level(number, seed)
+    map = level.map
+    for i in range(file.int()):
+        (cx, cy) = file.ints(2)
+        map.set_explored(cx, cy, file.bits(map.chunk_shape(cx, cy)))
+    terrain_changes = []
+    for i in range(file.int()):
+        change = tuple(file.ints(4)) + (file.bool(), file.bool())
+        map.fill(*change)
+        terrain_changes.append(change)
+
+    (num_objects, num_held, num_carried) = file.ints(3)
+    table = []
+    wearers = []
+    generated = {}
+    for i in range(num_objects + num_held + num_carried):
+        index = file.int()
+        if file.bool():
+            (obj, wearer_index) = read_object(file)
+        else:
+            (obj, wearer_index) = (level.objects[index], -1)
+        if index >= 0:
+            generated[obj] = (index, level.records[index])
+        table.append(obj)
+        wearers.append(wearer_index)
+    objects = table[:num_objects]
+    held = table[num_objects:num_objects + num_held]
+
+    (stairs_index, upstairs_index) = file.ints(2)
+    stairs = table[stairs_index]
+    upstairs = table[upstairs_index] if upstairs_index >= 0 else None
+
+    #put equipment back on whoever was wearing it
+    for (obj, wearer_index) in zip(table, wearers):
+        if wearer_index >= 0:
+            wearer = table[wearer_index]
+            wearer.fighter.slots[obj.equipment.slot] = obj.equipment
+            wearer.fighter.equipment_changed()
+            obj.equipment.wearer = wearer
+            obj.equipment.is_equipped = True
+
+    occupancy = OccupancyIndex(objects)  #the index isn't saved, it's rebuilt from the objects
+    return (held, table)
+
+def store_level():
+    #put the current level (everything but the player) in the level store, to come back to later
+    file = savefile.Writer()
+    write_level(file, [obj for obj in objects if obj != player], [])
+    levels.put(dungeon_level, file.finish(SAVE_VERSION))
+
+def restore_level(level, going_down):
+    #make a stored level the current one again, with the player arriving on the stairs they took
+    read_level(savefile.Reader(levels.get(level), SAVE_VERSION))
+    levels.discard(level)  #the store only holds the levels the player isn't on
+
+    arrival = upstairs if going_down else stairs
+    player.x = arrival.x
+    player.y = arrival.y
+    objects.insert(0, player)
+    occupancy.add(player)
+
+def encode_game():
+    #encode the game for a compact binary save file (see savefile.py): the current level as a delta
+    #against its seed (see write_level), with the inventory in its object table, then the other
+    #levels as they are in the level store.
+    #the encoded fields are a snapshot, so the game can go on while they're written out
+    file = savefile.Writer()
+    file.int(game_seed)
+    for name in GAME_STREAMS:
+        file.uint64(streams[name].state)
+    file.int(dungeon_level)
+    file.string(game_state)
+
+    table_index = write_level(file, objects, inventory)
+    file.int(table_index[player])
+    file.int(player.level)
+
+    file.int(len(game_msgs))
+    for (line, color) in game_msgs:
+        file.string(line)
+        file.color(color)
+
+    file.int(len(levels))
+    for level in levels.levels():
+        file.int(level)
+        file.blob(levels.peek(level))
+    return file
+
 def save_game():
-    #open a new empty shelve (possibly overwriting an old one) to write the game data
-    file = shelve.open('savegame', 'n')
-    file['map'] = map
-    file['objects'] = objects
-    file['player_index'] = objects.index(player)  #index of player in objects list
-    file['stairs_index'] = objects.index(stairs)  #same for the stairs
-    file['inventory'] = inventory
-    file['game_msgs'] = game_msgs
-    file['game_state'] = game_state
-    file['dungeon_level'] = dungeon_level
-    file.close()
+    #save and wait until it's on disk (after any autosave to the same file that is still being
+    #written). if it fails, that's raised here
+    save_writer.write(SAVE_FILE, encode_game(), SAVE_VERSION)
+
+def autosave():
+    #save without waiting: only the snapshot is taken here, the save writer's thread does the rest
+    report_save_failures()
+    if autosave_file is not None:
+        save_writer.save(autosave_file, encode_game(), SAVE_VERSION)
+
+def report_save_failures():
+    #tell the player about autosaves that failed on the save writer's thread
+    for (path, error) in save_writer.failures():
+        message('Autosave to ' + path + ' failed: ' + str(error), libtcod.red)
 
 def load_game():
-    #open the previously saved shelve and load the game data
-    global map, objects, player, stairs, inventory, game_msgs, game_state, dungeon_level
-
-    file = shelve.open('savegame', 'r')
-    map = file['map']
-    objects = file['objects']
-    player = objects[file['player_index']]  #get index of player in objects list and access it
-    stairs = objects[file['stairs_index']]  #same for the stairs
-    inventory = file['inventory']
-    game_msgs = file['game_msgs']
-    game_state = file['game_state']
-    dungeon_level = file['dungeon_level']
-    file.close()
+    #read back the game written by save_game()
+    global player, inventory, game_msgs, game_state, dungeon_level, game_seed, streams
+
+    save_writer.wait(SAVE_FILE)  #don't read a save that is still being written
+    with open(SAVE_FILE, 'rb') as f:
+        file = savefile.Reader(f.read(), SAVE_VERSION)
+
+    game_seed = file.int()
+    streams = dict((name, RandomStream(file.uint64())) for name in GAME_STREAMS)
+    dungeon_level = file.int()
+    game_state = file.string()
+
+    (inventory, table) = read_level(file)
+    player = table[file.int()]
+    player.level = file.int()
+
+    game_msgs = []
+    for i in range(file.int()):
+        line = file.string()
+        game_msgs.append((line, libtcod.Color(*file.color())))
+
+    levels.clear()
+    for i in range(file.int()):
+        level = file.int()
+        levels.put(level, file.blob())
+    fov_cache.clear()  #the cached FOV may be from a different game, or terrain since changed
 
     initialize_fov()
+    pregenerated.clear()
+    pregenerate_next_level()
 
 def new_game():
-    global player, inventory, game_msgs, game_state, dungeon_level
+    global player, inventory, game_msgs, game_state, dungeon_level, game_seed, streams
 
     #create object representing the player
     fighter_component = Fighter(hp=100, defense=1, power=2, xp=0, death_function=player_death)
@@ -1068,8 +1600,14 @@ def new_game():
 
     #generate map (at this point it's not drawn to the screen)
     dungeon_level = 1
+    levels.clear()
+    fov_cache.clear()
+    pregenerated.clear()
+    game_seed = libtcod.random_get_int(0, 0, 0x7fffffff)  #the seed all the randomness of this game comes from
+    streams = dict((name, RandomStream(stream_seed(game_seed, name))) for name in GAME_STREAMS)
     make_map()
     initialize_fov()
+    pregenerate_next_level()
 
     game_state = 'playing'
     inventory = []
@@ -1081,39 +1619,60 @@ def new_game():
     message('Welcome stranger! Prepare to perish in the Tombs of the Ancient Kings.', libtcod.red)
 
     #initial equipment: a dagger
-    equipment_component = Equipment(slot='right hand', power_bonus=2)
-    obj = Object(0, 0, '-', 'dagger', libtcod.sky, equipment=equipment_component)
+    obj = TEMPLATES.spawn('dagger', 0, 0)
     inventory.append(obj)
-    equipment_component.equip()
-    obj.always_visible = True
+    obj.equipment.equip()
 
 def next_level():
     #advance to the next level
     global dungeon_level
-    message('You take a moment to rest, and recover your strength.', libtcod.light_violet)
-    player.fighter.heal(player.fighter.max_hp / 2)  #heal the player by 50%
-
+    store_level()
     dungeon_level += 1
-    message('After a rare moment of peace, you descend deeper into the heart of the dungeon...', libtcod.red)
-    make_map()  #create a fresh new level!
+
+    if dungeon_level in levels:
+        #been here before: come back down the stairs up
+        message('You descend the stairs again.', libtcod.light_violet)
+        restore_level(dungeon_level, True)
+    else:
+        message('You take a moment to rest, and recover your strength.', libtcod.light_violet)
+        player.fighter.heal(player.fighter.max_hp // 2)  #heal the player by 50%
+
+        message('After a rare moment of peace, you descend deeper into the heart of the dungeon...', libtcod.red)
+        make_map()  #create a fresh new level!
+    initialize_fov()
+    pregenerate_next_level()
+    autosave()
+
+def previous_level():
+    #go back up to the level above, arriving on its stairs down
+    global dungeon_level
+    store_level()
+    dungeon_level -= 1
+
+    message('You climb back up the stairs.', libtcod.light_violet)
+    restore_level(dungeon_level, False)
     initialize_fov()
+    pregenerate_next_level()
+    autosave()
 
 def initialize_fov():
-    global fov_recompute, fov_map
+    global fov_recompute, fov_chunks, fov_box, drawn_style, player_flow_field
     fov_recompute = True
+    player_flow_field = None  #a new map needs a new flow field
 
-    #create the FOV map, according to the generated map
-    fov_map = libtcod.map_new(MAP_WIDTH, MAP_HEIGHT)
-    for y in range(MAP_HEIGHT):
-        for x in range(MAP_WIDTH):
-            libtcod.map_set_properties(fov_map, x, y, not map[x][y].block_sight, not map[x][y].blocked)
+    #create the FOV map over the chunks around the player, with nothing lit yet
+    fov_chunks = None
+    fov_box = None
+    update_resident_chunks()
 
     libtcod.console_clear(con)  #unexplored areas start black (which is the default background color)
+    drawn_style = None  #nothing of the new map has been drawn yet
 
 def play_game():
     global key, mouse
 
     player_action = None
+    turns = 0
 
     mouse = libtcod.Mouse()
     key = libtcod.Key()
@@ -1128,10 +1687,6 @@ def play_game():
         #level up if needed
         check_level_up()
 
-        #erase all objects at their old locations, before they move
-        #for object in objects:
-        #    object.clear()
-
         #handle keys and exit game if needed
         player_action = handle_keys()
         if player_action == 'exit':
@@ -1140,9 +1695,111 @@ def play_game():
 
         #let monsters take their turn
         if game_state == 'playing' and player_action != 'didnt-take-turn':
-            for object in objects:
-                if object.ai:
-                    object.ai.take_turn()
+            monsters_take_turn()
+            turns += 1
+            if turns % AUTOSAVE_TURNS == 0:
+                autosave()
+        report_save_failures()
+
+def monster_steps(x, y, blocked, origin):
+    #the tiles monsters at (x, y) step to, as arrays: like BasicMonster.take_turn, down the player's
+    #flow field, or straight at the player if that doesn't get them any closer. a monster that
+    #would walk into a "blocked" tile stays where it is ("blocked" is part of the map, with its
+    #top left corner at "origin")
+    (left, top) = origin
+    field = get_player_flow_field()
+    best = field.distances_at(x, y)
+    (step_x, step_y) = (x.copy(), y.copy())
+    for (dx, dy) in NEIGHBOURS:
+        distance = field.distances_at(x + dx, y + dy)
+        closer = (distance < best) & ~blocked[x + dx - left, y + dy - top]
+        best[closer] = distance[closer]
+        step_x[closer] = x[closer] + dx
+        step_y[closer] = y[closer] + dy
+
+    #the rest move towards the player as the crow flies (see Object.move_towards)
+    stuck = numpy.nonzero((step_x == x) & (step_y == y))[0]
+    dx = player.x - x[stuck]
+    dy = player.y - y[stuck]
+    distance = numpy.sqrt(dx ** 2 + dy ** 2)
+    towards_x = x[stuck] + numpy.rint(dx / distance).astype(numpy.intp)
+    towards_y = y[stuck] + numpy.rint(dy / distance).astype(numpy.intp)
+    free = ~blocked[towards_x - left, towards_y - top]
+    step_x[stuck[free]] = towards_x[free]
+    step_y[stuck[free]] = towards_y[free]
+    return (step_x, step_y)
+
+def basic_monsters_take_turn(monsters, blockers):
+    #BasicMonster.take_turn for many monsters at once, in vectorized passes over their positions:
+    #which ones the player can see, where the ones that are far away want to step, which of those
+    #steps don't collide, then the damage done by the ones next to the player.
+    #"blockers" are all the blocking objects on the map, these monsters included, as of the start of
+    #the turn: the ones that died since (and so stopped blocking) are skipped
+    if not monsters:
+        return
+    entities = EntitySnapshot(monsters)
+    (x, y) = (entities.x, entities.y)
+
+    #if you can see it, it can see you
+    active = numpy.nonzero(visible_at(x, y))[0]
+    far = (player.x - x[active]) ** 2 + (player.y - y[active]) ** 2 >= 4
+    movers = active[far]
+    attackers = active[~far]
+
+    #move towards player if far away, finding the way around walls and everything else that blocks.
+    #this goes in rounds: in each one, the monsters that haven't moved yet pick a step around where
+    #the others are now, until nobody moves any more. it comes out much like moving them one by one.
+    #the monsters that move are in the FOV, so that's as far as the tiles they could take go
+    if len(movers):
+        taken = map.window('blocked', fov_x, fov_y, fov_x + fov_width, fov_y + fov_height)
+        inside = [obj for obj in blockers
+                  if obj.blocks and fov_x <= obj.x < fov_x + fov_width and fov_y <= obj.y < fov_y + fov_height]
+        taken[[obj.x - fov_x for obj in inside], [obj.y - fov_y for obj in inside]] = True
+        (mover_x, mover_y) = (x[movers], y[movers])
+        moved = numpy.zeros(len(movers), dtype=bool)
+        pending = numpy.arange(len(movers))
+        while len(pending):
+            (step_x, step_y) = monster_steps(mover_x[pending], mover_y[pending], taken, (fov_x, fov_y))
+            stepped = resolve_moves(mover_x[pending] - fov_x, mover_y[pending] - fov_y,
+                                    step_x - fov_x, step_y - fov_y, taken)
+            if not stepped.any():
+                break
+            mover_x[pending[stepped]] = step_x[stepped]
+            mover_y[pending[stepped]] = step_y[stepped]
+            moved[pending[stepped]] = True
+            pending = pending[~stepped]
+
+        for i in numpy.nonzero(moved)[0].tolist():
+            monster = monsters[movers[i]]
+            (old_x, old_y) = (monster.x, monster.y)
+            (monster.x, monster.y) = (int(mover_x[i]), int(mover_y[i]))
+            occupancy.move(monster, old_x, old_y)
+
+    #close enough, attack! (if the player is still alive.) the damage is worked out for all of
+    #them at once, but each one still strikes on its own, since every attack has its message and
+    #the one that kills the player stops the rest
+    if len(attackers):
+        damage = entities.power(attackers) - player.fighter.defense
+        for (i, amount) in zip(attackers.tolist(), damage.tolist()):
+            if player.fighter.hp <= 0:
+                break
+            monsters[i].fighter.strike(player, amount)
+
+def monsters_take_turn():
+    #the monsters take their turn in the order of the objects list. each run of monsters with the
+    #basic AI in it goes together (see basic_monsters_take_turn), and the others (such as confused
+    #monsters) act one by one between those runs. the blocking objects are only found once: an
+    #object only stops blocking when it dies, and basic_monsters_take_turn skips those
+    blockers = [obj for obj in objects if obj.blocks]
+    basic = []
+    for object in objects:
+        if type(object.ai) is BasicMonster:
+            basic.append(object)
+        elif object.ai:
+            basic_monsters_take_turn(basic, blockers)
+            basic = []
+            object.ai.take_turn()
+    basic_monsters_take_turn(basic, blockers)
 
 def main_menu():
     img = libtcod.image_load('menu_background.png')
@@ -1173,10 +1830,13 @@ def main_menu():
         elif choice == 2:  #quit
             break
 
-libtcod.console_set_custom_font('font-6.png', libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_ASCII_INROW)
-libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'python/libtcod tutorial', False)
-libtcod.sys_set_fps(LIMIT_FPS)
-con = libtcod.console_new(MAP_WIDTH, MAP_HEIGHT)
+#off-screen consoles, which don't need a window
+con = libtcod.console_new(CAMERA_WIDTH, CAMERA_HEIGHT)
 panel = libtcod.console_new(SCREEN_WIDTH, PANEL_HEIGHT)
 
-main_menu()
+if __name__ == '__main__':
+    libtcod.console_set_custom_font('font-6.png', libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_ASCII_INROW)
+    libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'python/libtcod tutorial', False)
+    libtcod.sys_set_fps(LIMIT_FPS)
+
+    main_menu()
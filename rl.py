@@ -5,6 +5,9 @@ import textwrap
 import shelve
 import tcod as libtcod
 
+from tilemap import TileMap
+from templates import TemplateRegistry
+
 ###############CONSTANTS
 
 #actual size of the window
@@ -64,21 +67,13 @@ class Rect:
 		self.x2 = x + w
 		self.y2 = y + h
 	def center(self):
-		center_x = (self.x1 + self.x2) / 2
-		center_y = (self.y1 + self.y2) / 2
+		center_x = (self.x1 + self.x2) // 2
+		center_y = (self.y1 + self.y2) // 2
 		return (center_x, center_y)
 	def intersect(self, other):
 		return (self.x1 <= other.x2 and self.x2 >= other.x1 and
 				self.y1 <= other.y2 and self.y2 >= other.y1)
 
-class Tile:
-	def __init__(self, blocked, block_sight = None):
-		self.blocked = blocked
-		if block_sight == None:
-			block_sight = blocked
-		self.block_sight = block_sight
-		self.explored = False
-
 class Object:
 	def __init__(self, x, y, char, name, color, blocks=False, always_visible=False, fighter=None, ai=None, item=None):
 		self.always_visible = always_visible
@@ -102,7 +97,7 @@ class Object:
 			self.x += dx
 			self.y += dy
 	def draw(self):
-		if libtcod.map_is_in_fov(fov_map, self.x, self.y) or (self.always_visible and map[self.x][self.y].explored):
+		if libtcod.map_is_in_fov(fov_map, self.x, self.y) or (self.always_visible and map.explored[self.x, self.y]):
 			libtcod.console_set_default_foreground(con, self.color)
 			libtcod.console_put_char(con, self.x, self.y, self.char, libtcod.BKGND_NONE)
 	def clear(self):
@@ -312,6 +307,18 @@ def monster_death(monster):
 	monster.name = 'remains of ' + monster.name
 	monster.send_to_back()
 
+TEMPLATES = TemplateRegistry(Object, Fighter, Item)
+TEMPLATES.add_monsters([
+	('orc', 'o', 'orc', libtcod.desaturated_green, 10, 0, 3, 35),
+	('troll', 'T', 'troll', libtcod.darker_green, 16, 1, 4, 100),
+], ai=BasicMonster, death_function=monster_death)
+TEMPLATES.add_items([
+	('heal', '!', 'healing potion', libtcod.violet, cast_heal),
+	('lightning', '#', 'scroll of lightning bolt', libtcod.light_yellow, cast_lightning),
+	('fireball', '#', 'scroll of fireball', libtcod.light_yellow, cast_fireball),
+	('confuse', '#', 'scroll of confusion', libtcod.light_yellow, cast_confuse),
+])
+
 def player_move_or_attack(dx, dy):
 	global fov_recompute
 	x = player.x + dx
@@ -328,7 +335,7 @@ def player_move_or_attack(dx, dy):
 		fov_recompute = True
 
 def is_blocked(x, y):
-	if map[x][y].blocked:
+	if map.blocked[x, y]:
 		return True
 	for object in objects:
 		if object.blocks and object.x == x and object.y == y:
@@ -337,29 +344,20 @@ def is_blocked(x, y):
 
 def create_room(room):
 	global map
-	for x in range(room.x1 + 1, room.x2):
-		for y in range(room.y1 + 1, room.y2):
-			map[x][y].blocked = False
-			map[x][y].block_sight = False
+	map.dig(room.x1 + 1, room.y1 + 1, room.x2, room.y2)
 
 def create_h_tunnel(x1, x2, y):
 	global map
-	for x in range(min(x1, x2), max(x1, x2) + 1):
-		map[x][y].blocked = False
-		map[x][y].block_sight = False
+	map.dig(min(x1, x2), y, max(x1, x2) + 1, y + 1)
 
 def create_v_tunnel(y1, y2, x):
 	global map
-	for y in range(min(y1, y2), max(y1, y2) + 1):
-		map[x][y].blocked = False
-		map[x][y].block_sight = False
+	map.dig(x, min(y1, y2), x + 1, max(y1, y2) + 1)
 
 def make_map():
 	global map, player, objects, stairs
 	objects = [player]
-	map = [[ Tile(True)
-		for y in range(MAP_HEIGHT) ]
-			for x in range(MAP_WIDTH) ]
+	map = TileMap(MAP_WIDTH, MAP_HEIGHT)
 	rooms = []
 	num_rooms = 0
 	for r in range(MAX_ROOMS):
@@ -401,13 +399,9 @@ def place_objects(room):
 		y = libtcod.random_get_int(0, room.y1+1, room.y2-1)
 		if not is_blocked(x, y):
 			if libtcod.random_get_int(0, 0, 100) < 80:
-				fighter_component = Fighter(hp=10, defense=0, power=3, xp=35, death_function=monster_death)
-				ai_component = BasicMonster()
-				monster = Object(x, y, 'o', 'orc', libtcod.desaturated_green, blocks=True, fighter=fighter_component, ai=ai_component)
+				monster = TEMPLATES.spawn('orc', x, y)
 			else:
-				fighter_component = Fighter(hp=16, defense=1, power=4, xp=100, death_function=monster_death)
-				ai_component = BasicMonster()
-				monster = Object(x, y, 'T', 'troll', libtcod.darker_green, blocks=True, fighter=fighter_component, ai=ai_component)
+				monster = TEMPLATES.spawn('troll', x, y)
 			objects.append(monster)
 	num_items = libtcod.random_get_int(0, 0, MAX_ROOM_ITEMS)
 	for i in range(num_items):
@@ -416,17 +410,13 @@ def place_objects(room):
 		if not is_blocked(x, y):
 			dice = libtcod.random_get_int(0, 0, 100)
 			if dice < 70:
-				item_component = Item(use_function=cast_heal)
-				item = Object(x, y, "!", "healing potion", libtcod.violet, item=item_component, always_visible=True)
+				item = TEMPLATES.spawn('heal', x, y)
 			elif dice < 70+10:
-				item_component = Item(use_function=cast_lightning)
-				item = Object(x,y,'#','scroll of lightning bolt', libtcod.light_yellow, item=item_component, always_visible=True)
+				item = TEMPLATES.spawn('lightning', x, y)
 			elif dice < 70+10+10:
-				item_component = Item(use_function=cast_fireball)
-				item = Object(x,y,'#',"scroll of fireball", libtcod.light_yellow, item=item_component, always_visible=True)
+				item = TEMPLATES.spawn('fireball', x, y)
 			else:
-				item_component = Item(use_function=cast_confuse)
-				item = Object(x,y,'#','scroll of confusion', libtcod.light_yellow, item=item_component, always_visible=True)
+				item = TEMPLATES.spawn('confuse', x, y)
 			objects.append(item)
 			item.send_to_back()
 
@@ -440,9 +430,9 @@ def render_all():
 	for y in range(MAP_HEIGHT):
 		for x in range(MAP_WIDTH):
 			visible = libtcod.map_is_in_fov(fov_map, x, y)
-			wall = map[x][y].block_sight
+			wall = map.block_sight[x, y]
 			if not visible:
-				if map[x][y].explored:
+				if map.explored[x, y]:
 					if wall:
 						libtcod.console_set_char_background(con, x, y, color_dark_wall, libtcod.BKGND_SET)
 					else:
@@ -452,7 +442,7 @@ def render_all():
 					libtcod.console_set_char_background(con, x, y, color_light_wall, libtcod.BKGND_SET)
 				else:
 					libtcod.console_set_char_background(con, x, y, color_light_ground, libtcod.BKGND_SET)
-				map[x][y].explored = True
+				map.explored[x, y] = True
 	for object in objects:
 			if object != player:
 				object.draw()
@@ -660,9 +650,8 @@ def initialize_fov():
 	libtcod.console_clear(con)
 	fov_recompute = True
 	fov_map = libtcod.map_new(MAP_WIDTH,MAP_HEIGHT)
-	for y in range(MAP_HEIGHT):
-		for x in range(MAP_WIDTH):
-			libtcod.map_set_properties(fov_map,x,y,not map[x][y].block_sight, not map[x][y].blocked)
+	fov_map.transparent[:] = ~map.block_sight.T
+	fov_map.walkable[:] = ~map.blocked.T
 
 def play_game():
 	global key, mouse
@@ -0,0 +1,206 @@
+#
+# compact, versioned binary save files
+#
+# a save file is a short header (magic bytes and the format version) followed by a
+# zlib-compressed body. the body is a flat sequence of little-endian fields, written and
+# read back in the same order by the game: see save_game() and load_game() in potion.py
+#
+
+import os
+import struct
+import threading
+import zlib
+
+import numpy
+
+
+MAGIC = b'TOMB'
+HEADER = struct.Struct('<4sH')
+
+
+class SaveFormatError(ValueError):
+    pass
+
+
+class Writer:
+    #builds the body of a save file, one field at a time
+    def __init__(self):
+        self.parts = []
+
+    def int(self, value):
+        self.parts.append(struct.pack('<i', value))
+
+    def ints(self, *values):
+        self.parts.append(struct.pack('<%di' % len(values), *values))
+
+    def uint64(self, value):
+        #a 64-bit unsigned number, like the state of a random stream
+        self.parts.append(struct.pack('<Q', value))
+
+    def bool(self, value):
+        self.parts.append(struct.pack('<?', value))
+
+    def string(self, value):
+        data = value.encode('utf-8')
+        self.parts.append(struct.pack('<H', len(data)))
+        self.parts.append(data)
+
+    def color(self, color):
+        self.parts.append(struct.pack('<3B', color[0], color[1], color[2]))
+
+    def blob(self, data):
+        #raw bytes, like a level from the level store
+        self.parts.append(struct.pack('<I', len(data)))
+        self.parts.append(data)
+
+    def bits(self, array):
+        #a boolean array, eight cells per byte
+        data = numpy.packbits(array, axis=None).tobytes()
+        self.parts.append(struct.pack('<I', len(data)))
+        self.parts.append(data)
+
+    def raw(self, data):
+        #bytes that were already encoded, like the body of another writer
+        self.parts.append(data)
+
+    def body(self):
+        #everything written so far, uncompressed
+        return b''.join(self.parts)
+
+    def finish(self, version):
+        #the complete file: header, then the compressed body
+        return HEADER.pack(MAGIC, version) + zlib.compress(self.body())
+
+
+class Reader:
+    #reads the fields of a save file back, in the order they were written
+    def __init__(self, data, version):
+        if len(data) < HEADER.size:
+            raise SaveFormatError('Save file is truncated.')
+        (magic, file_version) = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise SaveFormatError('Not a save file.')
+        if file_version != version:
+            raise SaveFormatError('Save file has version ' + str(file_version) + ', expected ' + str(version) + '.')
+
+        self.data = zlib.decompress(data[HEADER.size:])
+        self.offset = 0
+
+    def unpack(self, format):
+        values = struct.unpack_from(format, self.data, self.offset)
+        self.offset += struct.calcsize(format)
+        return values
+
+    def int(self):
+        return self.unpack('<i')[0]
+
+    def ints(self, count):
+        return self.unpack('<%di' % count)
+
+    def uint64(self):
+        return self.unpack('<Q')[0]
+
+    def bool(self):
+        return self.unpack('<?')[0]
+
+    def string(self):
+        (length,) = self.unpack('<H')
+        value = self.data[self.offset:self.offset + length].decode('utf-8')
+        self.offset += length
+        return value
+
+    def color(self):
+        return self.unpack('<3B')
+
+    def blob(self):
+        (length,) = self.unpack('<I')
+        data = self.data[self.offset:self.offset + length]
+        self.offset += length
+        return data
+
+    def bits(self, shape):
+        (length,) = self.unpack('<I')
+        data = numpy.frombuffer(self.data, dtype=numpy.uint8, count=length, offset=self.offset)
+        self.offset += length
+        count = shape[0] * shape[1]
+        return numpy.unpackbits(data, count=count).reshape(shape).astype(bool)
+
+
+def write_file(path, data):
+    #write the whole file or nothing: it goes to a temporary file first, which replaces the
+    #old one only once it's safely on disk, so a crash halfway through leaves the old save intact
+    temp = path + '.tmp'
+    with open(temp, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp, path)
+
+
+class BackgroundWriter:
+    #finishes (compresses) and writes save files on a worker thread, so the game doesn't wait
+    #for the disk. if saves to a file come in faster than they're written, only the newest one
+    #to that file is kept. a save that fails there is kept in "failed" until failures() is called
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = {}  #path -> (writer, version) of the newest save queued for it
+        self.writing = None  #the path the worker is writing to, if any
+        self.failed = []  #(path, error) for each save that failed on the worker
+        self.thread = None
+
+    def save(self, path, writer, version):
+        #queue a save. the writer must not be touched afterwards
+        with self.condition:
+            self.pending.pop(path, None)
+            self.pending[path] = (writer, version)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='save writer')
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify_all()
+
+    def write(self, path, writer, version):
+        #save right away, on this thread, replacing any save to the same path that is still
+        #queued (after the one being written to it, if any). a failed save is raised here
+        with self.condition:
+            self.pending.pop(path, None)
+            while self.writing == path:
+                self.condition.wait()
+        write_file(path, writer.finish(version))
+
+    def wait(self, path=None):
+        #block until the saves queued for a path (or for every path) are on disk, or failed
+        with self.condition:
+            while self.busy_with(path):
+                self.condition.wait()
+
+    def busy_with(self, path):
+        #whether a save to a path (or to any path, if None) is queued or being written. the caller
+        #must hold the condition
+        if path is None:
+            return self.writing is not None or bool(self.pending)
+        return self.writing == path or path in self.pending
+
+    def failures(self):
+        #the (path, error) of every save that failed on the worker since the last call
+        with self.condition:
+            (failed, self.failed) = (self.failed, [])
+        return failed
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                path = next(iter(self.pending))
+                (writer, version) = self.pending.pop(path)
+                self.writing = path
+            try:
+                write_file(path, writer.finish(version))
+            except Exception as e:
+                with self.condition:
+                    self.failed.append((path, e))
+            finally:
+                with self.condition:
+                    self.writing = None
+                    self.condition.notify_all()
@@ -0,0 +1,83 @@
+#
+# spawn tables: what can show up in a room, and how often, on each dungeon level. they're
+# compiled once per level into alias tables, so each weighted draw takes constant time
+#
+
+
+def from_dungeon_level(table, number):
+    #returns a value that depends on the level number. the table specifies what value occurs after each level, default is 0.
+    for (value, level) in reversed(table):
+        if number >= level:
+            return value
+    return 0
+
+
+class AliasSampler:
+    #picks one of several choices with integer weights, using Vose's alias method: a column is picked
+    #uniformly, then a second draw decides between the column's own choice and its alias. all the
+    #arithmetic is on integers, so the odds are exactly the weights' and a seeded stream always
+    #gives the same picks
+    def __init__(self, weights):
+        #weights is a dictionary of choice -> weight. choices with no weight are left out
+        choices = [choice for (choice, weight) in weights.items() if weight > 0]
+        if not choices:
+            raise ValueError('Cannot sample from a table with no weights.')
+
+        count = len(choices)
+        self.total = sum(weights[choice] for choice in choices)
+        self.choices = choices
+        self.threshold = [0] * count  #in units of 1/total: below it the column keeps its own choice
+        self.alias = list(range(count))
+
+        #every column holds "total" units; scaled weights over that lend the rest to the ones under it
+        scaled = [weights[choice] * count for choice in choices]
+        small = [i for i in range(count) if scaled[i] < self.total]
+        large = [i for i in range(count) if scaled[i] >= self.total]
+        while small and large:
+            (less, more) = (small.pop(), large.pop())
+            self.threshold[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= self.total - scaled[less]
+            if scaled[more] < self.total:
+                small.append(more)
+            else:
+                large.append(more)
+        for i in small + large:
+            self.threshold[i] = self.total
+
+    def sample(self, rng):
+        #one choice, drawn from the given random stream
+        column = rng.randint(0, len(self.choices) - 1)
+        if rng.randint(0, self.total - 1) < self.threshold[column]:
+            return self.choices[column]
+        return self.choices[self.alias[column]]
+
+
+class LevelSpawns:
+    #the spawn tables as they are on one dungeon level
+    def __init__(self, tables, number):
+        self.number = number
+        self.max_monsters = from_dungeon_level(tables.max_monsters, number)
+        self.max_items = from_dungeon_level(tables.max_items, number)
+        self.monsters = AliasSampler(dict((name, from_dungeon_level(table, number))
+                                          for (name, table) in tables.monster_chances.items()))
+        self.items = AliasSampler(dict((name, from_dungeon_level(table, number))
+                                       for (name, table) in tables.item_chances.items()))
+
+
+class SpawnTables:
+    #the chances of each monster and item, and how many of them a room can have, as tables for
+    #from_dungeon_level. the tables of each level are only worked out the first time it's needed
+    def __init__(self, max_monsters, monster_chances, max_items, item_chances):
+        self.max_monsters = max_monsters
+        self.monster_chances = monster_chances
+        self.max_items = max_items
+        self.item_chances = item_chances
+        self.levels = {}
+
+    def level(self, number):
+        #the compiled tables for a dungeon level
+        spawns = self.levels.get(number)
+        if spawns is None:
+            spawns = self.levels[number] = LevelSpawns(self, number)
+        return spawns
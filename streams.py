@@ -0,0 +1,32 @@
+#
+# seedable random streams, one per subsystem, so that each one's results don't depend on
+# how many numbers the others have drawn
+#
+
+import zlib
+
+
+MASK = 0xffffffffffffffff
+
+
+def stream_seed(seed, name):
+    #the seed of a named stream, derived from a game or level seed
+    return (seed * 0x9e3779b97f4a7c15 + zlib.crc32(name.encode('utf-8'))) & MASK
+
+
+class RandomStream:
+    #a splitmix64 generator. its whole state is one 64-bit number, so it's cheap to save
+    def __init__(self, seed):
+        self.state = seed & MASK
+
+    def next(self):
+        #the next 64-bit number
+        self.state = (self.state + 0x9e3779b97f4a7c15) & MASK
+        z = self.state
+        z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & MASK
+        z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & MASK
+        return z ^ (z >> 31)
+
+    def randint(self, min, max):
+        #a number between min and max, both included (like libtcod.random_get_int)
+        return min + self.next() % (max - min + 1)
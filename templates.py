@@ -0,0 +1,62 @@
+#
+# entity templates: every kind of monster and item is one row of a table. the rows are turned
+# into factories once, when the game starts, with all of their constructor arguments bound
+#
+
+
+class TemplateRegistry:
+    #factories by template name. each game script has its own Object and component classes, so
+    #it passes them in (Equipment may be None, for a game without equipment)
+    def __init__(self, Object, Fighter, Item, Equipment=None):
+        self.Object = Object
+        self.Fighter = Fighter
+        self.Item = Item
+        self.Equipment = Equipment
+        self.factories = {}
+
+    def __contains__(self, name):
+        return name in self.factories
+
+    def spawn(self, name, x, y):
+        #a new object made from a template, at the given position
+        return self.factories[name](x, y)
+
+    def add_monsters(self, rows, ai, death_function):
+        #rows of (template name, char, name, color, hp, defense, power, xp). they all get a new
+        #instance of the "ai" class, and die with death_function
+        for (template, char, name, color, hp, defense, power, xp) in rows:
+            self.factories[template] = self.monster_factory(char, name, color, hp, defense, power, xp,
+                                                            ai, death_function)
+
+    def add_items(self, rows):
+        #rows of (template name, char, name, color, use function)
+        for (template, char, name, color, use_function) in rows:
+            self.factories[template] = self.item_factory(char, name, color, use_function)
+
+    def add_equipment(self, rows):
+        #rows of (template name, char, name, color, slot, power bonus, defense bonus, max hp bonus)
+        for (template, char, name, color, slot, power_bonus, defense_bonus, max_hp_bonus) in rows:
+            self.factories[template] = self.equipment_factory(char, name, color, slot,
+                                                              power_bonus, defense_bonus, max_hp_bonus)
+
+    def monster_factory(self, char, name, color, hp, defense, power, xp, ai, death_function):
+        (Object, Fighter) = (self.Object, self.Fighter)
+        def spawn(x, y):
+            fighter = Fighter(hp=hp, defense=defense, power=power, xp=xp, death_function=death_function)
+            return Object(x, y, char, name, color, blocks=True, fighter=fighter, ai=ai())
+        return spawn
+
+    def item_factory(self, char, name, color, use_function):
+        #items are visible even out-of-FOV, if in an explored area
+        (Object, Item) = (self.Object, self.Item)
+        def spawn(x, y):
+            return Object(x, y, char, name, color, always_visible=True, item=Item(use_function=use_function))
+        return spawn
+
+    def equipment_factory(self, char, name, color, slot, power_bonus, defense_bonus, max_hp_bonus):
+        (Object, Equipment) = (self.Object, self.Equipment)
+        def spawn(x, y):
+            equipment = Equipment(slot=slot, power_bonus=power_bonus, defense_bonus=defense_bonus,
+                                  max_hp_bonus=max_hp_bonus)
+            return Object(x, y, char, name, color, always_visible=True, equipment=equipment)
+        return spawn
@@ -0,0 +1,76 @@
+#
+# numpy-backed tile map
+#
+
+import numpy
+
+
+class TileMap:
+    #the map as a structure of arrays: one boolean layer per tile property, indexed [x, y]
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+        #fill map with "blocked" tiles, which also block sight; all tiles start unexplored
+        self.blocked = numpy.ones((width, height), dtype=bool)
+        self.block_sight = numpy.ones((width, height), dtype=bool)
+        self.explored = numpy.zeros((width, height), dtype=bool)
+
+    def dig(self, x1, y1, x2, y2):
+        #make every tile in the rectangle [x1, x2) x [y1, y2) passable and see-through
+        self.blocked[x1:x2, y1:y2] = False
+        self.block_sight[x1:x2, y1:y2] = False
+
+    def __len__(self):
+        return self.width
+
+    def __getitem__(self, x):
+        #compatibility with the old list-of-lists map, so map[x][y].blocked still works
+        return TileColumn(self, x)
+
+
+class TileColumn:
+    #one column of the map, as returned by map[x]
+    def __init__(self, map, x):
+        self.map = map
+        self.x = x
+
+    def __len__(self):
+        return self.map.height
+
+    def __getitem__(self, y):
+        return Tile(self.map, self.x, y)
+
+
+class Tile:
+    #a view of a single tile of the map and its properties
+    __slots__ = ('map', 'x', 'y')
+
+    def __init__(self, map, x, y):
+        self.map = map
+        self.x = x
+        self.y = y
+
+    @property
+    def blocked(self):
+        return bool(self.map.blocked[self.x, self.y])
+
+    @blocked.setter
+    def blocked(self, value):
+        self.map.blocked[self.x, self.y] = value
+
+    @property
+    def block_sight(self):
+        return bool(self.map.block_sight[self.x, self.y])
+
+    @block_sight.setter
+    def block_sight(self, value):
+        self.map.block_sight[self.x, self.y] = value
+
+    @property
+    def explored(self):
+        return bool(self.map.explored[self.x, self.y])
+
+    @explored.setter
+    def explored(self, value):
+        self.map.explored[self.x, self.y] = value
@@ -7,6 +7,10 @@ import tcod as libtcod
 import math
 import textwrap
 import shelve
+import numpy
+
+from tilemap import TileMap
+from templates import TemplateRegistry
 
 
 #actual size of the window
@@ -60,18 +64,6 @@ color_dark_ground = libtcod.Color(50, 50, 150)
 color_light_ground = libtcod.Color(200, 180, 50)
 
 
-class Tile:
-    #a tile of the map and its properties
-    def __init__(self, blocked, block_sight = None):
-        self.blocked = blocked
-
-        #all tiles start unexplored
-        self.explored = False
-
-        #by default, if a tile is blocked, it also blocks sight
-        if block_sight is None: block_sight = blocked
-        self.block_sight = block_sight
-
 class Rect:
     #a rectangle on the map. used to characterize a room.
     def __init__(self, x, y, w, h):
@@ -81,8 +73,8 @@ class Rect:
         self.y2 = y + h
 
     def center(self):
-        center_x = (self.x1 + self.x2) / 2
-        center_y = (self.y1 + self.y2) / 2
+        center_x = (self.x1 + self.x2) // 2
+        center_y = (self.y1 + self.y2) // 2
         return (center_x, center_y)
 
     def intersect(self, other):
@@ -158,7 +150,7 @@ class Object:
     def draw(self):
         #only show if it's visible to the player; or it's set to "always visible" and on an explored tile
         if (libtcod.map_is_in_fov(fov_map, self.x, self.y) or
-                (self.always_visible and map[self.x][self.y].explored)):
+                (self.always_visible and map.explored[self.x, self.y])):
             #set the color and then draw the character that represents this object at its position
             libtcod.console_set_default_foreground(con, self.color)
             libtcod.console_put_char(con, self.x, self.y, self.char, libtcod.BKGND_NONE)
@@ -177,21 +169,32 @@ class Fighter:
         self.base_power = power
         self.xp = xp
         self.death_function = death_function
+        self.bonuses = None  #(power, defense, max_hp) bonuses from equipped items, summed up when needed
+
+    def get_bonuses(self):
+        #sum up the bonuses from all equipped items, unless they're already known
+        if self.bonuses is None:
+            equipped = get_all_equipped(self.owner)
+            self.bonuses = (sum(equipment.power_bonus for equipment in equipped),
+                            sum(equipment.defense_bonus for equipment in equipped),
+                            sum(equipment.max_hp_bonus for equipment in equipped))
+        return self.bonuses
+
+    def equipment_changed(self):
+        #something was equipped or dequipped, so the bonuses must be summed up again
+        self.bonuses = None
 
     @property
-    def power(self):  #return actual power, by summing up the bonuses from all equipped items
-        bonus = sum(equipment.power_bonus for equipment in get_all_equipped(self.owner))
-        return self.base_power + bonus
+    def power(self):  #return actual power, by adding the bonuses from all equipped items
+        return self.base_power + self.get_bonuses()[0]
 
     @property
-    def defense(self):  #return actual defense, by summing up the bonuses from all equipped items
-        bonus = sum(equipment.defense_bonus for equipment in get_all_equipped(self.owner))
-        return self.base_defense + bonus
+    def defense(self):  #return actual defense, by adding the bonuses from all equipped items
+        return self.base_defense + self.get_bonuses()[1]
 
     @property
-    def max_hp(self):  #return actual max_hp, by summing up the bonuses from all equipped items
-        bonus = sum(equipment.max_hp_bonus for equipment in get_all_equipped(self.owner))
-        return self.base_max_hp + bonus
+    def max_hp(self):  #return actual max_hp, by adding the bonuses from all equipped items
+        return self.base_max_hp + self.get_bonuses()[2]
 
     def attack(self, target):
         #a simple formula for attack damage
@@ -323,12 +326,14 @@ class Equipment:
 
         #equip object and show a message about it
         self.is_equipped = True
+        player.fighter.equipment_changed()
         message('Equipped ' + self.owner.name + ' on ' + self.slot + '.', libtcod.light_green)
 
     def dequip(self):
         #dequip object and show a message about it
         if not self.is_equipped: return
         self.is_equipped = False
+        player.fighter.equipment_changed()
         message('Dequipped ' + self.owner.name + ' from ' + self.slot + '.', libtcod.light_yellow)
 
 
@@ -351,7 +356,7 @@ def get_all_equipped(obj):  #returns a list of equipped items
 
 def is_blocked(x, y):
     #first test the map tile
-    if map[x][y].blocked:
+    if map.blocked[x, y]:
         return True
 
     #now check for any blocking objects
@@ -363,25 +368,18 @@ def is_blocked(x, y):
 
 def create_room(room):
     global map
-    #go through the tiles in the rectangle and make them passable
-    for x in range(room.x1 + 1, room.x2):
-        for y in range(room.y1 + 1, room.y2):
-            map[x][y].blocked = False
-            map[x][y].block_sight = False
+    #make the tiles inside the rectangle passable
+    map.dig(room.x1 + 1, room.y1 + 1, room.x2, room.y2)
 
 def create_h_tunnel(x1, x2, y):
     global map
     #horizontal tunnel. min() and max() are used in case x1>x2
-    for x in range(min(x1, x2), max(x1, x2) + 1):
-        map[x][y].blocked = False
-        map[x][y].block_sight = False
+    map.dig(min(x1, x2), y, max(x1, x2) + 1, y + 1)
 
 def create_v_tunnel(y1, y2, x):
     global map
     #vertical tunnel
-    for y in range(min(y1, y2), max(y1, y2) + 1):
-        map[x][y].blocked = False
-        map[x][y].block_sight = False
+    map.dig(x, min(y1, y2), x + 1, max(y1, y2) + 1)
 
 def make_map():
     global map, objects, stairs
@@ -390,9 +388,7 @@ def make_map():
     objects = [player]
 
     #fill map with "blocked" tiles
-    map = [[ Tile(True)
-             for y in range(MAP_HEIGHT) ]
-           for x in range(MAP_WIDTH) ]
+    map = TileMap(MAP_WIDTH, MAP_HEIGHT)
 
     rooms = []
     num_rooms = 0
@@ -474,8 +470,8 @@ def random_choice_index(chances):  #choose one option from list of chances, retu
 
 def random_choice(chances_dict):
     #choose one option from dictionary of chances, returning its key
-    chances = chances_dict.values()
-    strings = chances_dict.keys()
+    chances = list(chances_dict.values())
+    strings = list(chances_dict.keys())
 
     return strings[random_choice_index(chances)]
 
@@ -520,23 +516,7 @@ def place_objects(room):
 
         #only place it if the tile is not blocked
         if not is_blocked(x, y):
-            choice = random_choice(monster_chances)
-            if choice == 'orc':
-                #create an orc
-                fighter_component = Fighter(hp=20, defense=0, power=4, xp=35, death_function=monster_death)
-                ai_component = BasicMonster()
-
-                monster = Object(x, y, 'o', 'orc', libtcod.desaturated_green,
-                                 blocks=True, fighter=fighter_component, ai=ai_component)
-
-            elif choice == 'troll':
-                #create a troll
-                fighter_component = Fighter(hp=30, defense=2, power=8, xp=100, death_function=monster_death)
-                ai_component = BasicMonster()
-
-                monster = Object(x, y, 'T', 'troll', libtcod.darker_green,
-                                 blocks=True, fighter=fighter_component, ai=ai_component)
-
+            monster = TEMPLATES.spawn(random_choice(monster_chances), x, y)
             objects.append(monster)
 
     #choose random number of items
@@ -549,40 +529,9 @@ def place_objects(room):
 
         #only place it if the tile is not blocked
         if not is_blocked(x, y):
-            choice = random_choice(item_chances)
-            if choice == 'heal':
-                #create a healing potion
-                item_component = Item(use_function=cast_heal)
-                item = Object(x, y, '!', 'healing potion', libtcod.violet, item=item_component)
-
-            elif choice == 'lightning':
-                #create a lightning bolt scroll
-                item_component = Item(use_function=cast_lightning)
-                item = Object(x, y, '#', 'scroll of lightning bolt', libtcod.light_yellow, item=item_component)
-
-            elif choice == 'fireball':
-                #create a fireball scroll
-                item_component = Item(use_function=cast_fireball)
-                item = Object(x, y, '#', 'scroll of fireball', libtcod.light_yellow, item=item_component)
-
-            elif choice == 'confuse':
-                #create a confuse scroll
-                item_component = Item(use_function=cast_confuse)
-                item = Object(x, y, '#', 'scroll of confusion', libtcod.light_yellow, item=item_component)
-
-            elif choice == 'sword':
-                #create a sword
-                equipment_component = Equipment(slot='right hand', power_bonus=3)
-                item = Object(x, y, '/', 'sword', libtcod.sky, equipment=equipment_component)
-
-            elif choice == 'shield':
-                #create a shield
-                equipment_component = Equipment(slot='left hand', defense_bonus=1)
-                item = Object(x, y, '[', 'shield', libtcod.darker_orange, equipment=equipment_component)
-
+            item = TEMPLATES.spawn(random_choice(item_chances), x, y)
             objects.append(item)
             item.send_to_back()  #items appear below other objects
-            item.always_visible = True  #items are visible even out-of-FOV, if in an explored area
 
 
 def render_bar(x, y, total_width, name, value, maximum, bar_color, back_color):
@@ -626,26 +575,19 @@ def render_all():
         fov_recompute = False
         libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
 
-        #go through all tiles, and set their background color according to the FOV
-        for y in range(MAP_HEIGHT):
-            for x in range(MAP_WIDTH):
-                visible = libtcod.map_is_in_fov(fov_map, x, y)
-                wall = map[x][y].block_sight
-                if not visible:
-                    #if it's not visible right now, the player can only see it if it's explored
-                    if map[x][y].explored:
-                        if wall:
-                            libtcod.console_set_char_background(con, x, y, color_dark_wall, libtcod.BKGND_SET)
-                        else:
-                            libtcod.console_set_char_background(con, x, y, color_dark_ground, libtcod.BKGND_SET)
-                else:
-                    #it's visible
-                    if wall:
-                        libtcod.console_set_char_background(con, x, y, color_light_wall, libtcod.BKGND_SET )
-                    else:
-                        libtcod.console_set_char_background(con, x, y, color_light_ground, libtcod.BKGND_SET )
-                        #since it's visible, explore it
-                    map[x][y].explored = True
+        #read the whole FOV as an array, transposed to [x, y] like the map layers
+        visible = fov_map.fov.T
+
+        #since it's visible, explore it
+        map.explored |= visible
+
+        #pick the background of every tile at once: dark/light, then ground/wall.
+        #tiles that are neither visible nor explored are left alone (black)
+        palette = numpy.array([color_dark_ground, color_dark_wall,
+                               color_light_ground, color_light_wall], dtype=numpy.uint8)
+        colors = palette[visible * 2 + map.block_sight]
+        background = con.bg.transpose(1, 0, 2)  #a view of the console's buffer, indexed [x, y]
+        background[map.explored] = colors[map.explored]
 
     #draw all objects in the list, except the player. we want it to
     #always appear over all other objects! so it's drawn later.
@@ -985,6 +927,28 @@ def cast_confuse():
     message('The eyes of the ' + monster.name + ' look vacant, as he starts to stumble around!', libtcod.light_green)
 
 
+#every kind of monster and item, by template name (the names the chances in place_objects use)
+TEMPLATES = TemplateRegistry(Object, Fighter, Item, Equipment)
+TEMPLATES.add_monsters([
+    #template  char  name      color                       hp  def  pow   xp
+    ('orc',     'o', 'orc',    libtcod.desaturated_green,  20,   0,   4,  35),
+    ('troll',   'T', 'troll',  libtcod.darker_green,       30,   2,   8, 100),
+], ai=BasicMonster, death_function=monster_death)
+TEMPLATES.add_items([
+    #template     char  name                        color                 use function
+    ('heal',       '!', 'healing potion',           libtcod.violet,       cast_heal),
+    ('lightning',  '#', 'scroll of lightning bolt', libtcod.light_yellow, cast_lightning),
+    ('fireball',   '#', 'scroll of fireball',       libtcod.light_yellow, cast_fireball),
+    ('confuse',    '#', 'scroll of confusion',      libtcod.light_yellow, cast_confuse),
+])
+TEMPLATES.add_equipment([
+    #template  char  name      color                  slot          pow  def  hp
+    ('sword',   '/', 'sword',  libtcod.sky,           'right hand',   3,   0,  0),
+    ('shield',  '[', 'shield', libtcod.darker_orange, 'left hand',    0,   1,  0),
+    ('dagger',  '-', 'dagger', libtcod.sky,           'right hand',   2,   0,  0),
+])
+
+
 def save_game():
     #open a new empty shelve (possibly overwriting an old one) to write the game data
     file = shelve.open('savegame', 'n')
@@ -1013,6 +977,8 @@ def load_game():
     dungeon_level = file['dungeon_level']
     file.close()
 
+    player.fighter.equipment_changed()  #don't trust bonuses saved with the player, sum them up from the inventory
+
     initialize_fov()
 
 def new_game():
@@ -1039,11 +1005,9 @@ def new_game():
     message('Welcome stranger! Prepare to perish in the Tombs of the Ancient Kings.', libtcod.red)
 
     #initial equipment: a dagger
-    equipment_component = Equipment(slot='right hand', power_bonus=2)
-    obj = Object(0, 0, '-', 'dagger', libtcod.sky, equipment=equipment_component)
+    obj = TEMPLATES.spawn('dagger', 0, 0)
     inventory.append(obj)
-    equipment_component.equip()
-    obj.always_visible = True
+    obj.equipment.equip()
 
 def next_level():
     #advance to the next level
@@ -1060,11 +1024,10 @@ def initialize_fov():
     global fov_recompute, fov_map
     fov_recompute = True
 
-    #create the FOV map, according to the generated map
+    #create the FOV map, according to the generated map (its arrays are indexed [y, x])
     fov_map = libtcod.map_new(MAP_WIDTH, MAP_HEIGHT)
-    for y in range(MAP_HEIGHT):
-        for x in range(MAP_WIDTH):
-            libtcod.map_set_properties(fov_map, x, y, not map[x][y].block_sight, not map[x][y].blocked)
+    fov_map.transparent[:] = ~map.block_sight.T
+    fov_map.walkable[:] = ~map.blocked.T
 
     libtcod.console_clear(con)  #unexplored areas start black (which is the default background color)
 